@@ -1,19 +1,60 @@
+import asyncio
+from contextlib import asynccontextmanager
 import time
-import datetime
-from typing import Dict, List, Optional, Any
+import functools
+import gzip
+import hashlib
+import hmac
+import re
+from html import escape
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Any, Tuple
+import orjson
 from fastapi import FastAPI, Request, HTTPException, Depends
-from fastapi.responses import HTMLResponse, JSONResponse
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, Response
+from pydantic import BaseModel, TypeAdapter
+import brotli
 import uvicorn
 
 # 导入原有的配置
-from baidu_api import Settings, RedisStore, KeyItem
+from baidu_api import (
+    Settings, RedisStore, KeyItem, TokenManager, ORJSONResponse, create_http_client, current_month_window,
+    seed_known_client_ids
+)
 
 # 初始化配置
 settings = Settings()
-store = RedisStore(settings.redis_url, settings.redis_password)
+store = RedisStore(settings.redis_url, settings.redis_password, max_connections=settings.redis_max_connections)
+manager = TokenManager(
+    store, settings.baidu_keys, settings.token_max_uses,
+    settings.monthly_quota_limit, settings.qps_limit,
+    settings.max_consecutive_errors, settings.health_check_interval
+)
+# 登录密码（与baidu_api相同的API_KEY），预先编码用于常量时间比较
+api_key_bytes = settings.api_key.encode() if settings.api_key else None
+# 当前配置中的client_id集合，用于O(1)判断密钥是否已删除
+current_client_ids = frozenset(key.client_id for key in settings.baidu_keys)
+# 管理面板页面等静态文件目录
+STATIC_DIR = Path(__file__).resolve().parent / "static"
 
-app = FastAPI(title="百度OCR API管理面板", description="Redis数据管理界面")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 刷新token时使用的共享HTTP客户端
+    manager.http = create_http_client()
+    # 管理面板可能单独启动，同样补登记旧数据中的client_id
+    try:
+        await seed_known_client_ids(store)
+    except Exception as e:
+        print(f"登记历史client_id失败: {e}")
+    yield
+    await manager.http.aclose()
+
+
+app = FastAPI(title="百度OCR API管理面板", description="Redis数据管理界面",
+              default_response_class=ORJSONResponse, lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=5)
 
 # 数据模型
 class TokenInfo(BaseModel):
@@ -37,6 +78,7 @@ class MonthlyUsageInfo(BaseModel):
     usage_count: int = 0
     quota_limit: int = 1000
     usage_percentage: float = 0.0
+    status_color: str = "#28a745"
 
 class SystemStats(BaseModel):
     total_keys: int
@@ -47,76 +89,101 @@ class SystemStats(BaseModel):
     expired_tokens: int
     total_monthly_usage: int
 
+class DashboardData(BaseModel):
+    stats: SystemStats
+    tokens_html: str
+    health: List[KeyHealthInfo]
+    usage: List[MonthlyUsageInfo]
+
+# 列表序列化器：直接由pydantic输出JSON字节，跳过jsonable_encoder
+token_list_adapter = TypeAdapter(List[TokenInfo])
+health_list_adapter = TypeAdapter(List[KeyHealthInfo])
+monthly_usage_list_adapter = TypeAdapter(List[MonthlyUsageInfo])
+
 # API路由
 @app.get("/", response_class=HTMLResponse)
 async def admin_dashboard(request: Request):
     """管理面板主页"""
-    return HTMLResponse(content=get_dashboard_html(), status_code=200)
+    # 按客户端支持的编码直接返回预压缩内容，避免每次请求重新压缩；
+    # 每种编码的字节不同，各自使用独立的强ETag
+    accept_encoding = request.headers.get("accept-encoding", "")
+    if "br" in accept_encoding:
+        encoding = "br"
+    elif "gzip" in accept_encoding:
+        encoding = "gzip"
+    else:
+        encoding = None
+    content, etag = DASHBOARD_VARIANTS[encoding]
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=60", "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=content, media_type="text/html", headers=headers)
 
 @app.post("/api/login")
 async def login(request: Request):
     """管理面板登录验证"""
     try:
-        body = await request.json()
+        body = orjson.loads(await request.body())
         password = body.get("password", "")
         
-        # 验证密码（使用与baidu_api相同的API_KEY）
-        if password == settings.api_key:
+        # 验证密码（使用与baidu_api相同的API_KEY），常量时间比较防止时序攻击
+        if api_key_bytes is not None and hmac.compare_digest(str(password).encode(), api_key_bytes):
             return {"success": True, "message": "登录成功"}
         else:
             return {"success": False, "message": "密码错误"}
     except Exception as e:
         return {"success": False, "message": f"登录失败: {str(e)}"}
 
-@app.get("/api/system/stats")
-async def get_system_stats() -> SystemStats:
+@app.get("/api/system/stats", response_model=SystemStats)
+async def get_system_stats(request: Request):
     """获取系统统计信息"""
     try:
-        # 获取所有token信息
-        tokens = await get_all_tokens()
-        
-        # 获取健康状态信息
-        health_info = await get_all_health_info()
-        
-        # 获取月度使用情况
-        monthly_usage = await get_all_monthly_usage()
-        
-        # 计算统计数据
-        total_keys = len(settings.baidu_keys)
-        healthy_keys = sum(1 for h in health_info if h.is_healthy)
-        unhealthy_keys = total_keys - healthy_keys
-        
-        active_tokens = sum(1 for t in tokens if not t.is_expired and t.token)
-        expired_tokens = sum(1 for t in tokens if t.is_expired)
-        
-        total_monthly_usage = sum(m.usage_count for m in monthly_usage)
-        
-        return SystemStats(
-            total_keys=total_keys,
-            healthy_keys=healthy_keys,
-            unhealthy_keys=unhealthy_keys,
-            total_tokens=len(tokens),
-            active_tokens=active_tokens,
-            expired_tokens=expired_tokens,
-            total_monthly_usage=total_monthly_usage
-        )
+        tokens, health_info, monthly_usage = await load_dashboard_data()
+        stats = build_system_stats(tokens, health_info, monthly_usage)
+        return conditional_response(request, stats.model_dump_json().encode())
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取系统统计失败: {str(e)}")
 
-@app.get("/api/tokens")
-async def get_tokens() -> List[TokenInfo]:
+@app.get("/api/dashboard", response_model=DashboardData)
+async def get_dashboard():
+    """一次性获取管理面板所需的全部数据"""
+    try:
+        tokens, health_info, monthly_usage = await load_dashboard_data()
+        dashboard = DashboardData(
+            stats=build_system_stats(tokens, health_info, monthly_usage),
+            tokens_html=render_tokens_table(tokens),
+            health=health_info,
+            usage=monthly_usage
+        )
+        return Response(content=dashboard.model_dump_json(), media_type="application/json")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取面板数据失败: {str(e)}")
+
+@app.get("/api/tokens", response_model=List[TokenInfo])
+async def get_tokens(request: Request):
     """获取所有token信息"""
-    return await get_all_tokens()
+    tokens = await cached("tokens", CACHE_TTL, get_all_tokens)
+    return conditional_response(request, token_list_adapter.dump_json(tokens))
+
+@app.get("/api/tokens.html", response_class=HTMLResponse)
+async def get_tokens_html(request: Request):
+    """获取服务端渲染的Token表格"""
+    tokens = await cached("tokens", CACHE_TTL, get_all_tokens)
+    return conditional_response(request, render_tokens_table(tokens).encode(), media_type="text/html")
 
-@app.get("/api/health")
-async def get_health() -> List[KeyHealthInfo]:
+@app.get("/api/health", response_model=List[KeyHealthInfo])
+async def get_health(request: Request):
     """获取所有密钥健康状态"""
-    return await get_all_health_info()
+    health_info = await cached("health", CACHE_TTL, get_all_health_info)
+    return conditional_response(request, health_list_adapter.dump_json(health_info))
 
-@app.get("/api/monthly-usage")
-async def get_monthly_usage() -> List[MonthlyUsageInfo]:
+@app.get("/api/monthly-usage", response_model=List[MonthlyUsageInfo])
+async def get_monthly_usage(request: Request):
     """获取月度使用情况"""
-    return await get_all_monthly_usage()
+    usage_info = await cached("monthly_usage", CACHE_TTL, get_all_monthly_usage)
+    return conditional_response(request, monthly_usage_list_adapter.dump_json(usage_info))
 
 @app.post("/api/tokens/{client_id}/refresh")
 async def refresh_token(client_id: str):
@@ -134,19 +201,13 @@ async def refresh_token(client_id: str):
         
         # 删除现有token
         await store.client.delete(f"token:{client_id}")
-        
-        # 创建TokenManager实例来获取新token
-        from baidu_api import TokenManager
-        manager = TokenManager(
-            store, settings.baidu_keys, settings.token_max_uses,
-            settings.monthly_quota_limit, settings.qps_limit,
-            settings.max_consecutive_errors, settings.health_check_interval
-        )
+        invalidate_cache()
         
         # 尝试获取新token
         try:
             new_token, used_key = await manager._fetch_new_token(target_key)
             await manager._save_token(target_key, new_token, 2592000)  # 30天有效期
+            invalidate_cache()
             return {"message": f"Token {client_id[:8]}... 刷新成功", "success": True}
         except Exception as token_error:
             return {"message": f"Token {client_id[:8]}... 刷新失败: {str(token_error)}", "success": False}
@@ -158,9 +219,10 @@ async def refresh_token(client_id: str):
 async def clear_all_tokens():
     """清除所有token"""
     try:
-        keys = await store.client.keys("token:*")
+        keys = [key async for key in _iter_keys("token:*")]
         if keys:
-            await store.client.delete(*keys)
+            await store.client.unlink(*keys)
+        invalidate_cache()
         return {"message": f"已清除 {len(keys)} 个token"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"清除token失败: {str(e)}")
@@ -170,6 +232,7 @@ async def reset_health(client_id: str):
     """重置指定密钥的健康状态"""
     try:
         await store.client.delete(f"health:{client_id}")
+        invalidate_cache()
         return {"message": f"密钥 {client_id} 健康状态已重置"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"重置健康状态失败: {str(e)}")
@@ -178,9 +241,10 @@ async def reset_health(client_id: str):
 async def clear_monthly_usage():
     """清除所有月度使用记录"""
     try:
-        keys = await store.client.keys("monthly:*")
+        keys = [key async for key in _iter_keys("monthly:*")]
         if keys:
-            await store.client.delete(*keys)
+            await store.client.unlink(*keys)
+        invalidate_cache()
         return {"message": f"已清除 {len(keys)} 个月度使用记录"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"清除月度使用记录失败: {str(e)}")
@@ -189,934 +253,314 @@ async def clear_monthly_usage():
 async def cleanup_orphaned_data():
     """清理已删除密钥的残留数据"""
     try:
-        current_client_ids = {key.client_id for key in settings.baidu_keys}
         cleaned_count = 0
+        orphaned_client_ids = set()
         
-        # 清理token数据
-        token_keys = await store.client.keys("token:*")
-        for token_key_bytes in token_keys:
-            token_key = token_key_bytes.decode() if isinstance(token_key_bytes, bytes) else token_key_bytes
-            client_id = token_key.replace("token:", "")
-            if client_id not in current_client_ids:
-                await store.client.delete(token_key)
-                cleaned_count += 1
-        
-        # 清理健康状态数据
-        health_keys = await store.client.keys("health:*")
-        for health_key_bytes in health_keys:
-            health_key = health_key_bytes.decode() if isinstance(health_key_bytes, bytes) else health_key_bytes
-            client_id = health_key.replace("health:", "")
-            if client_id not in current_client_ids:
-                await store.client.delete(health_key)
-                cleaned_count += 1
-        
-        # 清理月度使用数据
-        monthly_keys = await store.client.keys("monthly:*")
-        for monthly_key_bytes in monthly_keys:
-            monthly_key = monthly_key_bytes.decode() if isinstance(monthly_key_bytes, bytes) else monthly_key_bytes
-            # monthly:client_id:YYYY-MM
-            parts = monthly_key.split(":")
-            if len(parts) >= 2:
-                client_id = parts[1]
+        # 清理token和健康状态数据：先收集孤立键，再一次性批量删除
+        for prefix in ("token:", "health:"):
+            orphaned_keys = []
+            async for key in _iter_keys(f"{prefix}*"):
+                client_id = key.replace(prefix, "")
                 if client_id not in current_client_ids:
-                    await store.client.delete(monthly_key)
-                    cleaned_count += 1
+                    orphaned_keys.append(key)
+                    orphaned_client_ids.add(client_id)
+            if orphaned_keys:
+                cleaned_count += await store.client.unlink(*orphaned_keys)
+        
+        # 清理月度使用数据：monthly:YYYY-MM 哈希中已删除密钥的字段
+        async for monthly_key in _iter_keys("monthly:*", key_type="hash"):
+            monthly_client_ids = await store.client.hkeys(monthly_key)
+            orphaned_fields = [cid for cid in monthly_client_ids if cid not in current_client_ids]
+            if orphaned_fields:
+                cleaned_count += await store.client.hdel(monthly_key, *orphaned_fields)
+        
+        # 从已知client_id集合中移除已清理的密钥
+        async for known_id in store.client.sscan_iter("known_client_ids"):
+            if known_id not in current_client_ids:
+                orphaned_client_ids.add(known_id)
+        if orphaned_client_ids:
+            await store.client.srem("known_client_ids", *orphaned_client_ids)
+        invalidate_cache()
         
         return {"message": f"已清理 {cleaned_count} 个孤立数据项"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"清理孤立数据失败: {str(e)}")
 
 # 辅助函数
+
+# 短TTL进程内缓存：{key: (过期时间, 缓存值, 进行中的任务)}
+CACHE_TTL = 3
+_cache: Dict[str, Tuple[float, Any, Optional[asyncio.Task]]] = {}
+
+async def cached(key: str, ttl: float, coro_factory: Callable[[], Awaitable[Any]]) -> Any:
+    """带TTL的进程内缓存，并发请求共享同一次Redis读取"""
+    expiry, value, task = _cache.get(key, (0.0, None, None))
+    if time.monotonic() < expiry:
+        return value
+    
+    if task is None:
+        task = asyncio.create_task(coro_factory())
+        _cache[key] = (expiry, value, task)
+        
+        def _on_done(done_task: asyncio.Task):
+            # 缓存已被清空或替换时不回写
+            if _cache.get(key, (0.0, None, None))[2] is not done_task:
+                return
+            if done_task.cancelled() or done_task.exception() is not None:
+                _cache.pop(key, None)
+            else:
+                _cache[key] = (time.monotonic() + ttl, done_task.result(), None)
+        
+        task.add_done_callback(_on_done)
+    
+    return await asyncio.shield(task)
+
+def invalidate_cache():
+    """数据被修改后清空缓存"""
+    _cache.clear()
+
+def conditional_response(request: Request, content: bytes, media_type: str = "application/json") -> Response:
+    """返回带弱ETag的响应，内容与客户端缓存一致时返回304"""
+    etag = f'W/"{hashlib.blake2b(content, digest_size=8).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+async def load_dashboard_data() -> Tuple[List[TokenInfo], List[KeyHealthInfo], List[MonthlyUsageInfo]]:
+    """并发获取token、健康状态和月度使用数据"""
+    return await asyncio.gather(
+        cached("tokens", CACHE_TTL, get_all_tokens),
+        cached("health", CACHE_TTL, get_all_health_info),
+        cached("monthly_usage", CACHE_TTL, get_all_monthly_usage)
+    )
+
+def build_system_stats(tokens: List[TokenInfo], health_info: List[KeyHealthInfo],
+                       monthly_usage: List[MonthlyUsageInfo]) -> SystemStats:
+    """根据已获取的数据计算统计信息"""
+    total_keys = len(settings.baidu_keys)
+    healthy_keys = sum(1 for h in health_info if h.is_healthy)
+    unhealthy_keys = total_keys - healthy_keys
+    
+    active_tokens = sum(1 for t in tokens if not t.is_expired and t.token)
+    expired_tokens = sum(1 for t in tokens if t.is_expired)
+    
+    total_monthly_usage = sum(m.usage_count for m in monthly_usage)
+    
+    return SystemStats(
+        total_keys=total_keys,
+        healthy_keys=healthy_keys,
+        unhealthy_keys=unhealthy_keys,
+        total_tokens=len(tokens),
+        active_tokens=active_tokens,
+        expired_tokens=expired_tokens,
+        total_monthly_usage=total_monthly_usage
+    )
+
+def int_field(data: Dict[str, str], field: str) -> int:
+    """读取Redis哈希中的整数字段，缺失或为空时返回0"""
+    return int(data.get(field) or 0)
+
+@functools.lru_cache(maxsize=4096)
+def format_timestamp(ts: int) -> str:
+    """格式化时间戳为 YYYY-MM-DD HH:MM:SS，避免构造datetime对象和strftime"""
+    lt = time.localtime(ts)
+    return (f"{lt.tm_year:04d}-{lt.tm_mon:02d}-{lt.tm_mday:02d} "
+            f"{lt.tm_hour:02d}:{lt.tm_min:02d}:{lt.tm_sec:02d}")
+
+TOKENS_TABLE_HEAD = (
+    '<table class="table"><thead><tr>'
+    '<th>客户端ID</th><th>Token状态</th><th>剩余使用次数</th><th>过期时间</th><th>操作</th>'
+    '</tr></thead><tbody>'
+)
+
+def _token_status(token: TokenInfo) -> Tuple[str, str]:
+    """返回Token状态对应的样式类和文字"""
+    if token.is_expired:
+        return "status-expired", "已过期"
+    if token.token:
+        return "status-active", "正常"
+    return "status-unhealthy", "无Token"
+
+def render_tokens_table(tokens: List[TokenInfo]) -> str:
+    """服务端渲染Token表格，前端直接插入即可"""
+    rows = []
+    for token in tokens:
+        status_class, status_text = _token_status(token)
+        rows.append(
+            f'<tr><td>{escape(token.client_id[:8])}...</td>'
+            f'<td><span class="status-badge {status_class}">{status_text}</span></td>'
+            f'<td>{token.remaining}</td>'
+            f'<td>{escape(token.expire_time or "无")}</td>'
+            f'<td><button class="btn btn-primary" data-action="refresh-token" '
+            f'data-id="{escape(token.client_id)}">刷新</button></td></tr>'
+        )
+    return TOKENS_TABLE_HEAD + "".join(rows) + "</tbody></table>"
+
+async def _iter_keys(pattern: str, key_type: Optional[str] = None):
+    """使用SCAN非阻塞地遍历匹配的键，避免KEYS阻塞Redis"""
+    async for key in store.client.scan_iter(match=pattern, count=500, _type=key_type):
+        yield key
+
+async def get_known_client_ids() -> List[str]:
+    """获取当前配置的client_id以及Redis中记录过数据的client_id"""
+    client_ids = [key.client_id for key in settings.baidu_keys]
+    known_ids = await store.client.smembers("known_client_ids")
+    for known_id in known_ids:
+        if known_id not in current_client_ids:
+            client_ids.append(known_id)
+    return client_ids
+
 async def get_all_tokens() -> List[TokenInfo]:
     """获取所有token信息"""
-    tokens = []
     current_time = int(time.time())
     
-    # 获取Redis中所有token键
-    token_keys = await store.client.keys("token:*")
-    processed_client_ids = set()
+    # 从已知client_id集合获取需要读取的token键，无需扫描键空间
+    client_ids = await get_known_client_ids()
+    
+    # 一次pipeline批量读取所有token数据，避免逐个HGETALL的往返延迟
+    async with store.client.pipeline(transaction=False) as pipe:
+        for client_id in client_ids:
+            pipe.hgetall(f"token:{client_id}")
+        token_results = await pipe.execute()
     
-    # 处理Redis中存在的token数据
-    for token_key_bytes in token_keys:
-        token_key = token_key_bytes.decode() if isinstance(token_key_bytes, bytes) else token_key_bytes
-        client_id = token_key.replace("token:", "")
-        processed_client_ids.add(client_id)
+    # 先为当前配置中的密钥填充空数据，再用Redis中存在的token数据覆盖
+    tokens = {key.client_id: TokenInfo.model_construct(client_id=key.client_id) for key in settings.baidu_keys}
+    for client_id, token_data in zip(client_ids, token_results):
+        if not token_data:
+            continue
         
-        token_data = await store.client.hgetall(token_key)
+        expire_ts = int_field(token_data, 'expire_ts')
+        expire_time = format_timestamp(expire_ts) if expire_ts else None
+        is_expired = expire_ts < current_time if expire_ts else True
         
-        if token_data:
-            expire_ts = int(token_data.get(b'expire_ts', 0))
-            expire_time = datetime.datetime.fromtimestamp(expire_ts).strftime('%Y-%m-%d %H:%M:%S') if expire_ts else None
-            is_expired = expire_ts < current_time if expire_ts else True
-            
-            # 检查是否是当前配置中的密钥
-            is_current_key = any(key.client_id == client_id for key in settings.baidu_keys)
-            
-            tokens.append(TokenInfo(
-                client_id=client_id + (" [已删除]" if not is_current_key else ""),
-                token=token_data.get(b'token', b'').decode() if token_data.get(b'token') else None,
-                remaining=int(token_data.get(b'remaining', 0)),
-                expire_ts=expire_ts if expire_ts else None,
-                expire_time=expire_time,
-                is_expired=is_expired
-            ))
-    
-    # 处理当前配置中但Redis中没有token数据的密钥
-    for key in settings.baidu_keys:
-        if key.client_id not in processed_client_ids:
-            tokens.append(TokenInfo(client_id=key.client_id))
+        # 检查是否是当前配置中的密钥
+        is_current_key = client_id in current_client_ids
+        
+        # 字段已在此完成类型转换，使用model_construct跳过pydantic校验
+        tokens[client_id] = TokenInfo.model_construct(
+            client_id=client_id + (" [已删除]" if not is_current_key else ""),
+            token=token_data.get('token') or None,
+            remaining=int_field(token_data, 'remaining'),
+            expire_ts=expire_ts if expire_ts else None,
+            expire_time=expire_time,
+            is_expired=is_expired
+        )
     
-    return tokens
+    return list(tokens.values())
 
 async def get_all_health_info() -> List[KeyHealthInfo]:
     """获取所有密钥健康状态"""
-    health_info = []
     current_time = int(time.time())
     
-    # 获取Redis中所有健康状态键
-    health_keys = await store.client.keys("health:*")
-    processed_client_ids = set()
+    # 从已知client_id集合获取需要读取的健康状态键，无需扫描键空间
+    client_ids = await get_known_client_ids()
     
-    # 处理Redis中存在的健康状态数据
-    for health_key_bytes in health_keys:
-        health_key = health_key_bytes.decode() if isinstance(health_key_bytes, bytes) else health_key_bytes
-        client_id = health_key.replace("health:", "")
-        processed_client_ids.add(client_id)
-        
-        health_data = await store.client.hgetall(health_key)
+    # 一次pipeline批量读取所有健康状态数据
+    async with store.client.pipeline(transaction=False) as pipe:
+        for client_id in client_ids:
+            pipe.hgetall(f"health:{client_id}")
+        health_results = await pipe.execute()
+    
+    # 先为当前配置中的密钥填充健康的默认状态，再用Redis中存在的健康状态数据覆盖
+    health_info = {
+        key.client_id: KeyHealthInfo.model_construct(
+            client_id=key.client_id,
+            consecutive_errors=0,
+            last_error_time=None,
+            is_healthy=True,
+            next_retry_time=None
+        )
+        for key in settings.baidu_keys
+    }
+    for client_id, health_data in zip(client_ids, health_results):
+        if not health_data:
+            continue
         
-        consecutive_errors = 0
-        last_error_time = None
         is_healthy = True
         next_retry_time = None
+        consecutive_errors = int_field(health_data, 'consecutive_errors')
+        last_error_time = int_field(health_data, 'last_error_time')
+        unhealthy_flag = health_data.get('unhealthy', 'false').lower()
         
-        if health_data:
-            consecutive_errors = int(health_data.get(b'consecutive_errors', 0))
-            last_error_time = int(health_data.get(b'last_error_time', 0))
-            unhealthy_flag = health_data.get(b'unhealthy', b'false').decode().lower()
-            
-            # 检查健康状态：要么连续错误超限，要么被明确标记为不健康
-            if consecutive_errors >= settings.max_consecutive_errors or unhealthy_flag == 'true':
-                is_healthy = False
-                next_retry = last_error_time + settings.health_check_interval
-                if next_retry > current_time:
-                    next_retry_time = datetime.datetime.fromtimestamp(next_retry).strftime('%Y-%m-%d %H:%M:%S')
+        # 检查健康状态：要么连续错误超限，要么被明确标记为不健康
+        if consecutive_errors >= settings.max_consecutive_errors or unhealthy_flag == 'true':
+            is_healthy = False
+            next_retry = last_error_time + settings.health_check_interval
+            if next_retry > current_time:
+                next_retry_time = format_timestamp(next_retry)
         
         # 检查是否是当前配置中的密钥
-        is_current_key = any(key.client_id == client_id for key in settings.baidu_keys)
+        is_current_key = client_id in current_client_ids
         
-        health_info.append(KeyHealthInfo(
+        health_info[client_id] = KeyHealthInfo.model_construct(
             client_id=client_id + (" [已删除]" if not is_current_key else ""),
             consecutive_errors=consecutive_errors,
             last_error_time=last_error_time,
             is_healthy=is_healthy,
             next_retry_time=next_retry_time
-        ))
-    
-    # 处理当前配置中但Redis中没有健康状态数据的密钥
-    for key in settings.baidu_keys:
-        if key.client_id not in processed_client_ids:
-            health_info.append(KeyHealthInfo(
-                client_id=key.client_id,
-                consecutive_errors=0,
-                last_error_time=None,
-                is_healthy=True,
-                next_retry_time=None
-            ))
+        )
     
-    return health_info
+    return list(health_info.values())
+
+def _usage_status_color(usage_percentage: float) -> str:
+    """返回使用率对应的进度条颜色"""
+    if usage_percentage > 80:
+        return "#dc3545"
+    if usage_percentage > 60:
+        return "#ffc107"
+    return "#28a745"
 
 async def get_all_monthly_usage() -> List[MonthlyUsageInfo]:
     """获取所有月度使用情况"""
     usage_info = []
-    current_month = time.strftime("%Y-%m")
+    current_month, _ = current_month_window()
+    
+    # 一次HGETALL读取本月所有密钥的使用量
+    monthly_data = await store.client.hgetall(f"monthly:{current_month}")
     
     for key in settings.baidu_keys:
-        monthly_key = f"monthly:{key.client_id}:{current_month}"
-        usage_count = await store.client.get(monthly_key)
-        usage_count = int(usage_count) if usage_count else 0
+        usage_count = int_field(monthly_data, key.client_id)
         
-        usage_percentage = (usage_count / settings.monthly_quota_limit) * 100 if settings.monthly_quota_limit > 0 else 0
+        usage_percentage = (usage_count / settings.monthly_quota_limit) * 100 if settings.monthly_quota_limit > 0 else 0.0
+        usage_percentage = round(usage_percentage, 1)
         
-        usage_info.append(MonthlyUsageInfo(
+        usage_info.append(MonthlyUsageInfo.model_construct(
             client_id=key.client_id,
             month=current_month,
             usage_count=usage_count,
             quota_limit=settings.monthly_quota_limit,
-            usage_percentage=round(usage_percentage, 1)
+            usage_percentage=usage_percentage,
+            status_color=_usage_status_color(usage_percentage)
         ))
     
     return usage_info
 
-def get_dashboard_html() -> str:
-    """返回管理面板HTML"""
-    return """
-<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>百度OCR API管理面板</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            color: #333;
-        }
-        
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 20px;
-        }
-        
-        .header {
-            text-align: center;
-            margin-bottom: 30px;
-            color: white;
-        }
-        
-        .header h1 {
-            font-size: 2.5rem;
-            margin-bottom: 10px;
-            text-shadow: 0 2px 4px rgba(0,0,0,0.3);
-        }
-        
-        .header p {
-            font-size: 1.1rem;
-            opacity: 0.9;
-        }
-        
-        .stats-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 20px;
-            margin-bottom: 30px;
-        }
-        
-        .stat-card {
-            background: white;
-            padding: 20px;
-            border-radius: 12px;
-            box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-            text-align: center;
-            transition: transform 0.2s;
-        }
-        
-        .stat-card:hover {
-            transform: translateY(-2px);
-        }
-        
-        .stat-number {
-            font-size: 2rem;
-            font-weight: bold;
-            color: #667eea;
-            margin-bottom: 5px;
-        }
-        
-        .stat-label {
-            color: #666;
-            font-size: 0.9rem;
-        }
-        
-        .tabs {
-            display: flex;
-            background: white;
-            border-radius: 12px;
-            padding: 5px;
-            margin-bottom: 20px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }
-        
-        .tab {
-            flex: 1;
-            padding: 12px 20px;
-            text-align: center;
-            border-radius: 8px;
-            cursor: pointer;
-            transition: all 0.2s;
-            font-weight: 500;
-        }
-        
-        .tab.active {
-            background: #667eea;
-            color: white;
-        }
-        
-        .tab:hover:not(.active) {
-            background: #f5f5f5;
-        }
-        
-        .content-panel {
-            background: white;
-            border-radius: 12px;
-            padding: 20px;
-            box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-            display: none;
-        }
-        
-        .content-panel.active {
-            display: block;
-        }
-        
-        .table {
-            width: 100%;
-            border-collapse: collapse;
-            margin-top: 15px;
-        }
-        
-        .table th,
-        .table td {
-            padding: 12px;
-            text-align: left;
-            border-bottom: 1px solid #eee;
-        }
-        
-        .table th {
-            background: #f8f9fa;
-            font-weight: 600;
-            color: #555;
-        }
-        
-        .status-badge {
-            padding: 4px 8px;
-            border-radius: 12px;
-            font-size: 0.8rem;
-            font-weight: 500;
-        }
-        
-        .status-healthy {
-            background: #d4edda;
-            color: #155724;
-        }
-        
-        .status-unhealthy {
-            background: #f8d7da;
-            color: #721c24;
-        }
-        
-        .status-active {
-            background: #d1ecf1;
-            color: #0c5460;
-        }
-        
-        .status-expired {
-            background: #fff3cd;
-            color: #856404;
-        }
-        
-        .progress-bar {
-            width: 100%;
-            height: 8px;
-            background: #e9ecef;
-            border-radius: 4px;
-            overflow: hidden;
-        }
-        
-        .progress-fill {
-            height: 100%;
-            background: linear-gradient(90deg, #28a745, #ffc107, #dc3545);
-            transition: width 0.3s;
-        }
-        
-        .btn {
-            padding: 8px 16px;
-            border: none;
-            border-radius: 6px;
-            cursor: pointer;
-            font-size: 0.9rem;
-            transition: all 0.2s;
-            margin: 2px;
-        }
-        
-        .btn-primary {
-            background: #667eea;
-            color: white;
-        }
-        
-        .btn-primary:hover {
-            background: #5a6fd8;
-        }
-        
-        .btn-danger {
-            background: #dc3545;
-            color: white;
-        }
-        
-        .btn-danger:hover {
-            background: #c82333;
-        }
-        
-        .btn-success {
-            background: #28a745;
-            color: white;
-        }
-        
-        .btn-success:hover {
-            background: #218838;
-        }
-        
-        .loading {
-            text-align: center;
-            padding: 40px;
-            color: #666;
-        }
-        
-        .error {
-            background: #f8d7da;
-            color: #721c24;
-            padding: 15px;
-            border-radius: 8px;
-            margin: 10px 0;
-        }
-        
-        .success {
-            background: #d4edda;
-            color: #155724;
-            padding: 15px;
-            border-radius: 8px;
-            margin: 10px 0;
-        }
-        
-        .login-container {
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            min-height: 100vh;
-            padding: 20px;
-        }
-        
-        .login-box {
-            background: white;
-            padding: 40px;
-            border-radius: 16px;
-            box-shadow: 0 8px 32px rgba(0,0,0,0.1);
-            text-align: center;
-            max-width: 400px;
-            width: 100%;
-        }
-        
-        .login-box h2 {
-            color: #667eea;
-            margin-bottom: 10px;
-            font-size: 1.8rem;
-        }
-        
-        .login-box p {
-            color: #666;
-            margin-bottom: 30px;
-        }
-        
-        .login-form {
-            display: flex;
-            flex-direction: column;
-            gap: 15px;
-        }
-        
-        .login-form input {
-            padding: 12px 16px;
-            border: 2px solid #e9ecef;
-            border-radius: 8px;
-            font-size: 1rem;
-            transition: border-color 0.2s;
-        }
-        
-        .login-form input:focus {
-            outline: none;
-            border-color: #667eea;
-        }
-        
-        .logout-btn {
-            position: absolute;
-            top: 20px;
-            right: 20px;
-            font-size: 0.9rem;
-        }
-        
-        @media (max-width: 768px) {
-            .container {
-                padding: 10px;
-            }
-            
-            .header h1 {
-                font-size: 2rem;
-            }
-            
-            .tabs {
-                flex-direction: column;
-            }
-            
-            .table {
-                font-size: 0.9rem;
-            }
-            
-            .logout-btn {
-                position: static;
-                margin-top: 10px;
-            }
-        }
-    </style>
-</head>
-<body>
-    <!-- 登录页面 -->
-    <div id="loginPage" class="login-container">
-        <div class="login-box">
-            <h2>🔐 管理面板登录</h2>
-            <p>请输入管理密码访问面板</p>
-            <div class="login-form">
-                <input type="password" id="loginPassword" placeholder="请输入管理密码" />
-                <button class="btn btn-primary" onclick="performLogin()">登录</button>
-            </div>
-            <div id="loginError" class="error" style="display: none;"></div>
-        </div>
-    </div>
+def minify_html(html: str) -> str:
+    """简单压缩HTML：去除注释、缩进和空行（保留换行，避免影响JS自动分号插入）"""
+    html = re.sub(r"<!--.*?-->", "", html, flags=re.S)
+    html = re.sub(r"/\*.*?\*/", "", html, flags=re.S)
+    lines = (line.strip() for line in html.splitlines())
+    return "\n".join(line for line in lines if line and not line.startswith("//"))
 
-    <!-- 主面板 -->
-    <div id="mainPanel" class="container" style="display: none;">
-        <div class="header">
-            <h1>🚀 百度OCR API管理面板</h1>
-            <button class="btn btn-danger logout-btn" onclick="logout()">退出登录</button>
-        </div>
-        
-        <div class="stats-grid" id="statsGrid">
-            <div class="loading">正在加载统计数据...</div>
-        </div>
-        
-        <div class="tabs">
-            <div class="tab active" onclick="switchTab('tokens')">Token管理</div>
-            <div class="tab" onclick="switchTab('health')">健康状态</div>
-            <div class="tab" onclick="switchTab('usage')">使用统计</div>
-        </div>
-        
-        <div id="tokens" class="content-panel active">
-            <h3>🔑 Token管理</h3>
-            <button class="btn btn-danger" onclick="clearAllTokens()">清除所有Token</button>
-            <div id="tokensContent">
-                <div class="loading">正在加载Token数据...</div>
-            </div>
-        </div>
-        
-        <div id="health" class="content-panel">
-            <h3>💚 健康状态监控</h3>
-            <button class="btn btn-danger" onclick="cleanupOrphanedData()">清理孤立数据</button>
-            <div id="healthContent">
-                <div class="loading">正在加载健康状态数据...</div>
-            </div>
-        </div>
-        
-        <div id="usage" class="content-panel">
-            <h3>📊 月度使用统计</h3>
-            <button class="btn btn-danger" onclick="clearMonthlyUsage()">清除月度记录</button>
-            <div id="usageContent">
-                <div class="loading">正在加载使用统计数据...</div>
-            </div>
-        </div>
-    </div>
-
-    <script>
-        let currentTab = 'tokens';
-        let isLoggedIn = false;
-        
-        // 页面加载时初始化
-        document.addEventListener('DOMContentLoaded', function() {
-            checkLoginStatus();
-        });
-        
-        // 检查登录状态
-        function checkLoginStatus() {
-            const savedPassword = localStorage.getItem('adminPassword');
-            if (savedPassword) {
-                // 验证保存的密码
-                verifyPassword(savedPassword, true);
-            } else {
-                showLoginPage();
-            }
-        }
-        
-        // 显示登录页面
-        function showLoginPage() {
-            document.getElementById('loginPage').style.display = 'flex';
-            document.getElementById('mainPanel').style.display = 'none';
-            isLoggedIn = false;
-        }
-        
-        // 显示主面板
-        function showMainPanel() {
-            document.getElementById('loginPage').style.display = 'none';
-            document.getElementById('mainPanel').style.display = 'block';
-            isLoggedIn = true;
-            loadAllData();
-            // 每30秒自动刷新数据
-            setInterval(loadAllData, 30000);
-        }
-        
-        // 执行登录
-        async function performLogin() {
-            const password = document.getElementById('loginPassword').value;
-            if (!password) {
-                showLoginError('请输入密码');
-                return;
-            }
-            
-            await verifyPassword(password, false);
-        }
-        
-        // 验证密码
-        async function verifyPassword(password, isAutoLogin) {
-            try {
-                const response = await fetch('/api/login', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({ password: password })
-                });
-                
-                const result = await response.json();
-                
-                if (result.success) {
-                    // 登录成功，保存密码到localStorage
-                    localStorage.setItem('adminPassword', password);
-                    showMainPanel();
-                    if (!isAutoLogin) {
-                        showMessage('登录成功', 'success');
-                    }
-                } else {
-                    if (isAutoLogin) {
-                        // 自动登录失败，清除保存的密码
-                        localStorage.removeItem('adminPassword');
-                        showLoginPage();
-                    } else {
-                        showLoginError(result.message);
-                    }
-                }
-            } catch (error) {
-                if (isAutoLogin) {
-                    localStorage.removeItem('adminPassword');
-                    showLoginPage();
-                } else {
-                    showLoginError('登录请求失败');
-                }
-            }
-        }
-        
-        // 显示登录错误
-        function showLoginError(message) {
-            const errorDiv = document.getElementById('loginError');
-            errorDiv.textContent = message;
-            errorDiv.style.display = 'block';
-            setTimeout(() => {
-                errorDiv.style.display = 'none';
-            }, 3000);
-        }
-        
-        // 退出登录
-        function logout() {
-            localStorage.removeItem('adminPassword');
-            showLoginPage();
-            showMessage('已退出登录', 'success');
-        }
-        
-        // 回车键登录
-        document.addEventListener('keypress', function(e) {
-            if (e.key === 'Enter' && !isLoggedIn) {
-                performLogin();
-            }
-        });
-        
-        // 切换标签页
-        function switchTab(tabName) {
-            // 更新标签样式
-            document.querySelectorAll('.tab').forEach(tab => tab.classList.remove('active'));
-            event.target.classList.add('active');
-            
-            // 更新内容面板
-            document.querySelectorAll('.content-panel').forEach(panel => panel.classList.remove('active'));
-            document.getElementById(tabName).classList.add('active');
-            
-            currentTab = tabName;
-        }
-        
-        // 加载所有数据
-        async function loadAllData() {
-            await Promise.all([
-                loadStats(),
-                loadTokens(),
-                loadHealth(),
-                loadUsage()
-            ]);
-        }
-        
-        // 加载统计数据
-        async function loadStats() {
-            try {
-                const response = await fetch('/api/system/stats');
-                const stats = await response.json();
-                
-                document.getElementById('statsGrid').innerHTML = `
-                    <div class="stat-card">
-                        <div class="stat-number">${stats.total_keys}</div>
-                        <div class="stat-label">总密钥数</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">${stats.healthy_keys}</div>
-                        <div class="stat-label">健康密钥</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">${stats.active_tokens}</div>
-                        <div class="stat-label">活跃Token</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">${stats.total_monthly_usage}</div>
-                        <div class="stat-label">本月总使用</div>
-                    </div>
-                `;
-            } catch (error) {
-                console.error('加载统计数据失败:', error);
-            }
-        }
-        
-        // 加载Token数据
-        async function loadTokens() {
-            try {
-                const response = await fetch('/api/tokens');
-                const tokens = await response.json();
-                
-                let html = `
-                    <table class="table">
-                        <thead>
-                            <tr>
-                                <th>客户端ID</th>
-                                <th>Token状态</th>
-                                <th>剩余使用次数</th>
-                                <th>过期时间</th>
-                                <th>操作</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-                `;
-                
-                tokens.forEach(token => {
-                    const statusClass = token.is_expired ? 'status-expired' : (token.token ? 'status-active' : 'status-unhealthy');
-                    const statusText = token.is_expired ? '已过期' : (token.token ? '正常' : '无Token');
-                    
-                    html += `
-                        <tr>
-                            <td>${token.client_id.substring(0, 8)}...</td>
-                            <td><span class="status-badge ${statusClass}">${statusText}</span></td>
-                            <td>${token.remaining}</td>
-                            <td>${token.expire_time || '无'}</td>
-                            <td>
-                                <button class="btn btn-primary" onclick="refreshToken('${token.client_id}')">刷新</button>
-                            </td>
-                        </tr>
-                    `;
-                });
-                
-                html += '</tbody></table>';
-                document.getElementById('tokensContent').innerHTML = html;
-            } catch (error) {
-                document.getElementById('tokensContent').innerHTML = '<div class="error">加载Token数据失败</div>';
-            }
-        }
-        
-        // 加载健康状态数据
-        async function loadHealth() {
-            try {
-                const response = await fetch('/api/health');
-                const healthData = await response.json();
-                
-                let html = `
-                    <table class="table">
-                        <thead>
-                            <tr>
-                                <th>客户端ID</th>
-                                <th>健康状态</th>
-                                <th>连续错误次数</th>
-                                <th>下次重试时间</th>
-                                <th>操作</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-                `;
-                
-                healthData.forEach(health => {
-                    const statusClass = health.is_healthy ? 'status-healthy' : 'status-unhealthy';
-                    const statusText = health.is_healthy ? '健康' : '不健康';
-                    
-                    html += `
-                        <tr>
-                            <td>${health.client_id.substring(0, 8)}...</td>
-                            <td><span class="status-badge ${statusClass}">${statusText}</span></td>
-                            <td>${health.consecutive_errors}</td>
-                            <td>${health.next_retry_time || '无'}</td>
-                            <td>
-                                <button class="btn btn-success" onclick="resetHealth('${health.client_id}')">重置</button>
-                            </td>
-                        </tr>
-                    `;
-                });
-                
-                html += '</tbody></table>';
-                document.getElementById('healthContent').innerHTML = html;
-            } catch (error) {
-                document.getElementById('healthContent').innerHTML = '<div class="error">加载健康状态数据失败</div>';
-            }
-        }
-        
-        // 加载使用统计数据
-        async function loadUsage() {
-            try {
-                const response = await fetch('/api/monthly-usage');
-                const usageData = await response.json();
-                
-                let html = `
-                    <table class="table">
-                        <thead>
-                            <tr>
-                                <th>客户端ID</th>
-                                <th>月份</th>
-                                <th>使用次数</th>
-                                <th>配额限制</th>
-                                <th>使用率</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-                `;
-                
-                usageData.forEach(usage => {
-                    const progressColor = usage.usage_percentage > 80 ? '#dc3545' : 
-                                        usage.usage_percentage > 60 ? '#ffc107' : '#28a745';
-                    
-                    html += `
-                        <tr>
-                            <td>${usage.client_id.substring(0, 8)}...</td>
-                            <td>${usage.month}</td>
-                            <td>${usage.usage_count}</td>
-                            <td>${usage.quota_limit}</td>
-                            <td>
-                                <div class="progress-bar">
-                                    <div class="progress-fill" style="width: ${usage.usage_percentage}%; background: ${progressColor}"></div>
-                                </div>
-                                <small>${usage.usage_percentage}%</small>
-                            </td>
-                        </tr>
-                    `;
-                });
-                
-                html += '</tbody></table>';
-                document.getElementById('usageContent').innerHTML = html;
-            } catch (error) {
-                document.getElementById('usageContent').innerHTML = '<div class="error">加载使用统计数据失败</div>';
-            }
-        }
-        
-        // 刷新单个Token
-        async function refreshToken(clientId) {
-            try {
-                const response = await fetch(`/api/tokens/${clientId}/refresh`, {
-                    method: 'POST'
-                });
-                const result = await response.json();
-                
-                showMessage(result.message, 'success');
-                loadTokens();
-            } catch (error) {
-                showMessage('刷新Token失败', 'error');
-            }
-        }
-        
-        // 清除所有Token
-        async function clearAllTokens() {
-            if (!confirm('确定要清除所有Token吗？')) return;
-            
-            try {
-                const response = await fetch('/api/tokens/clear-all', {
-                    method: 'POST'
-                });
-                const result = await response.json();
-                
-                showMessage(result.message, 'success');
-                loadTokens();
-            } catch (error) {
-                showMessage('清除Token失败', 'error');
-            }
-        }
-        
-        // 重置健康状态
-        async function resetHealth(clientId) {
-            try {
-                const response = await fetch(`/api/health/${clientId}/reset`, {
-                    method: 'POST'
-                });
-                const result = await response.json();
-                
-                showMessage(result.message, 'success');
-                loadHealth();
-            } catch (error) {
-                showMessage('重置健康状态失败', 'error');
-            }
-        }
-        
-        // 清除月度使用记录
-        async function clearMonthlyUsage() {
-            if (!confirm('确定要清除所有月度使用记录吗？')) return;
-            
-            try {
-                const response = await fetch('/api/monthly-usage/clear', {
-                    method: 'POST'
-                });
-                const result = await response.json();
-                
-                showMessage(result.message, 'success');
-                loadUsage();
-            } catch (error) {
-                showMessage('清除月度使用记录失败', 'error');
-            }
-        }
-        
-        // 清理孤立数据
-        async function cleanupOrphanedData() {
-            if (!confirm('确定要清理已删除密钥的孤立数据吗？这将删除不在当前配置中的密钥的所有Redis数据。')) return;
-            
-            try {
-                const response = await fetch('/api/cleanup/orphaned-data', {
-                    method: 'POST'
-                });
-                const result = await response.json();
-                
-                showMessage(result.message, 'success');
-                loadAllData(); // 重新加载所有数据
-            } catch (error) {
-                showMessage('清理孤立数据失败', 'error');
-            }
-        }
-        
-        // 显示消息
-        function showMessage(message, type) {
-            const messageDiv = document.createElement('div');
-            messageDiv.className = type;
-            messageDiv.textContent = message;
-            
-            const container = document.querySelector('.container');
-            container.insertBefore(messageDiv, container.firstChild);
-            
-            setTimeout(() => {
-                messageDiv.remove();
-            }, 3000);
-        }
-    </script>
-</body>
-</html>
-    """
+# 管理面板页面位于static/admin.html，启动时读取并压缩一次，预先生成gzip/brotli版本和ETag
+DASHBOARD_HTML = minify_html((STATIC_DIR / "admin.html").read_text(encoding="utf-8")).encode()
+DASHBOARD_HTML_GZIP = gzip.compress(DASHBOARD_HTML, compresslevel=9)
+DASHBOARD_HTML_BROTLI = brotli.compress(DASHBOARD_HTML, quality=11)
+DASHBOARD_ETAG = f'"{hashlib.blake2b(DASHBOARD_HTML, digest_size=8).hexdigest()}"'
+# 各编码对应的 (响应体, ETag)，压缩版本在同一ETag后追加编码后缀
+DASHBOARD_VARIANTS = {
+    "br": (DASHBOARD_HTML_BROTLI, f'{DASHBOARD_ETAG[:-1]}-br"'),
+    "gzip": (DASHBOARD_HTML_GZIP, f'{DASHBOARD_ETAG[:-1]}-gz"'),
+    None: (DASHBOARD_HTML, DASHBOARD_ETAG),
+}
 
 if __name__ == "__main__":
     print("启动百度OCR API管理面板...")
-    uvicorn.run(app, host="0.0.0.0", port=8181)
\ No newline at end of file
+    # 接口缓存和invalidate_cache()只在本进程内生效，管理面板必须单worker运行，
+    # 否则修改后的刷新请求可能落到另一个worker并读到旧数据；
+    # loop="auto" 在安装了uvloop时自动使用uvloop（Windows回退asyncio）
+    uvicorn.run(
+        app, host="0.0.0.0", port=8181,
+        loop="auto", http="httptools", log_level="warning"
+    )
\ No newline at end of file
@@ -1,19 +1,30 @@
 from __future__ import annotations
-import base64
-import json
+import asyncio
+import hashlib
+import itertools
+import re
 import time
-import calendar
-import datetime
+from collections import defaultdict
 from contextlib import asynccontextmanager
-from typing import Any, Dict, List, Optional, Tuple
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, List, Optional, Set, Tuple
 import httpx
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Depends, Header
+import orjson
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Depends, Header, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, Field, field_validator
 from pydantic_settings import BaseSettings
-from redis.asyncio import Redis
-from urllib.parse import urlparse, urlunparse
+from redis.asyncio import BlockingConnectionPool, Redis
+from urllib.parse import quote_plus, urlparse, urlunparse
 from dotenv import load_dotenv
 
+try:
+    # SIMD加速的base64编码，未安装时回退到标准库
+    from pybase64 import b64encode
+except ImportError:
+    from base64 import b64encode
+
 # 加载.env文件
 load_dotenv()
 
@@ -33,10 +44,13 @@ class Settings(BaseSettings):
     )
     redis_url: str = Field("redis://localhost:6379/8", env="REDIS_URL")
     redis_password: Optional[str] = Field(None, env="REDIS_PASSWORD")
+    redis_max_connections: int = Field(64, env="REDIS_MAX_CONNECTIONS", description="Redis连接池最大连接数")
     token_max_uses: int = Field(900, env="TOKEN_MAX_USES")
     # 新增：月配额监控
     monthly_quota_limit: int = Field(1000, env="MONTHLY_QUOTA_LIMIT")
     qps_limit: int = Field(2, env="QPS_LIMIT")
+    # 上传文件识别结果的缓存时间（秒），默认0不缓存
+    ocr_cache_ttl: int = Field(0, env="OCR_CACHE_TTL")
     # 健康检查配置
     max_consecutive_errors: int = Field(3, env="MAX_CONSECUTIVE_ERRORS", description="连续错误次数阈值")
     health_check_interval: int = Field(3600, env="HEALTH_CHECK_INTERVAL", description="健康检查间隔（秒）")
@@ -64,12 +78,12 @@ class Settings(BaseSettings):
     def _parse_keys(cls, v):
         if isinstance(v, str):
             try:
-                parsed = json.loads(v)
+                parsed = orjson.loads(v)
                 if not isinstance(parsed, list):
                     raise ValueError("BAIDU_KEYS必须是JSON数组格式")
                 result = [KeyItem(**item) for item in parsed]
                 return result
-            except json.JSONDecodeError as e:
+            except orjson.JSONDecodeError as e:
                 print(f"BAIDU_KEYS JSON格式错误: {e}")
                 print(f"   原始值: {v}")
                 print("   正确格式示例: [{'client_id':'xxx','client_secret':'yyy'}]")
@@ -88,12 +102,30 @@ if not settings.baidu_keys:
     raise ValueError("BAIDU_KEYS环境变量未配置或为空，请在.env文件中配置API密钥")
 
 
+@dataclass(frozen=True)
+class HotSettings:
+    """请求路径上读取的配置快照，启动时由Settings校验后生成一次"""
+    __slots__ = ("api_key", "baidu_keys", "baidu_token_url",
+                 "token_max_uses", "monthly_quota_limit", "qps_limit", "ocr_cache_ttl")
+    api_key: Optional[str]
+    baidu_keys: List[KeyItem]
+    baidu_token_url: str
+    token_max_uses: int
+    monthly_quota_limit: int
+    qps_limit: int
+    ocr_cache_ttl: int
+
+
+hot_settings = HotSettings(**{name: getattr(settings, name) for name in HotSettings.__slots__})
+
+
 # ---------------------------
 # Redis 辅助
 # ---------------------------
 
 class RedisStore:
-    def __init__(self, url: str, password: Optional[str] = None):
+    def __init__(self, url: str, password: Optional[str] = None, decode_responses: bool = True,
+                 max_connections: int = 64):
         # 当 URL 未包含密码且提供了 REDIS_PASSWORD 时，拼入密码
         if password:
             parsed = urlparse(url)
@@ -107,23 +139,276 @@ class RedisStore:
                 else:
                     netloc = f":{password}@{netloc}"
                 url = urlunparse((parsed.scheme, netloc, parsed.path, parsed.params, parsed.query, parsed.fragment))
-        self._client = Redis.from_url(url)
+        # 连接数达到上限时等待空闲连接而不是直接报错；安装hiredis后redis-py自动使用C解析器，
+        # 默认decode_responses由解析器直接返回str，调用方无需再逐项decode
+        self._pool = BlockingConnectionPool.from_url(
+            url,
+            max_connections=max_connections,
+            timeout=5,
+            decode_responses=decode_responses,
+            health_check_interval=30,
+            socket_keepalive=True,
+        )
+        self._client = Redis(connection_pool=self._pool)
 
     @property
     def client(self) -> Redis:
         return self._client
 
+    async def unlink_matching(self, pattern: str, count: int = 1000) -> int:
+        """按SCAN批次UNLINK匹配的键，每批一次往返，内存回收由Redis后台线程完成"""
+        deleted = 0
+        cursor = 0
+        while True:
+            cursor, keys = await self._client.scan(cursor=cursor, match=pattern, count=count)
+            if keys:
+                deleted += await self._client.unlink(*keys)
+            if cursor == 0:
+                return deleted
+
     async def close(self):
         await self._client.aclose()
+        await self._pool.disconnect()
+
+
+# ---------------------------
+# HTTP 客户端
+# ---------------------------
+
+def create_http_client() -> httpx.AsyncClient:
+    """创建进程内共享的HTTP客户端，通过连接池和HTTP/2复用与百度API之间的连接"""
+    return httpx.AsyncClient(
+        http2=True,
+        # 百度接口不可达时尽快失败，不占满30秒的读超时
+        timeout=httpx.Timeout(30, connect=5),
+        limits=httpx.Limits(max_keepalive_connections=64, max_connections=256),
+    )
+
+
+# 百度OCR接口只接受x-www-form-urlencoded请求体，image/pdf_file/ofd_file必须是base64编码，
+# 不支持multipart或原始二进制上传，因此文件内容只能编码后转发
+FORM_HEADERS = {"content-type": "application/x-www-form-urlencoded"}
+# OCR接口地址在启动时拼好，请求时只需追加token
+OCR_URL_PREFIX = f"{settings.baidu_ocr_url}?access_token="
+
+
+# 分块读取上传文件的块大小，取3的倍数使每块base64编码结果可以直接拼接
+UPLOAD_CHUNK_SIZE = 48 * 1024
+
+
+def _file_too_large(max_size: int, size: int) -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=f"文件大小超过限制。最大允许: {max_size // (1024 * 1024)}MB，当前文件: {size // (1024 * 1024)}MB"
+    )
+
+
+def _form_escape_base64(encoded: bytes) -> bytes:
+    # base64字符集中只有 + / = 需要转义，用bytes.replace代替逐字节的quote_from_bytes
+    return encoded.replace(b"+", b"%2B").replace(b"/", b"%2F").replace(b"=", b"%3D")
+
+
+def _encode_form_base64(fp: BinaryIO, max_size: int, known_size: Optional[int],
+                        with_digest: bool) -> Tuple[bytearray, Optional[str]]:
+    encoded = bytearray()
+    digest = hashlib.sha256() if with_digest else None
+    carry = b""
+    size = 0
+    while True:
+        chunk = fp.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            raise _file_too_large(max_size, known_size or size)
+        if digest is not None:
+            digest.update(chunk)
+        # 读到的块不足3的倍数时，余下的字节留到下一块一起编码，避免中途出现填充
+        if carry:
+            chunk = carry + chunk
+        cut = len(chunk) - len(chunk) % 3
+        encoded += _form_escape_base64(b64encode(memoryview(chunk)[:cut]))
+        carry = chunk[cut:]
+    if carry:
+        encoded += _form_escape_base64(b64encode(carry))
+    return encoded, digest.hexdigest() if digest is not None else None
+
+
+async def read_form_base64(file: UploadFile, max_size: int) -> Tuple[bytearray, Optional[str]]:
+    """分块读取上传文件，逐块base64编码并做表单转义，结果可直接作为form_body的字段值
+
+    转义在每个小块上完成，内存中不会同时存在完整的原始内容、base64内容和转义后内容。
+    整个读取和编码过程放到线程池中一次完成，不阻塞事件循环。
+    开启识别结果缓存时同时计算文件内容的SHA-256，返回 (编码结果, 摘要或None)。
+    """
+    # multipart解析时已知文件大小的，超限直接拒绝，不再读取
+    if file.size is not None and file.size > max_size:
+        raise _file_too_large(max_size, file.size)
+    await file.seek(0)
+    return await run_in_threadpool(
+        _encode_form_base64, file.file, max_size, file.size, hot_settings.ocr_cache_ttl > 0
+    )
+
+
+def form_body(fields: Dict[str, Any]) -> Tuple[List[bytes], int]:
+    """按顺序生成x-www-form-urlencoded请求体的各个片段，同时返回总长度
+
+    bytes值视为已转义的表单值（read_form_base64的结果）原样使用，str值按urlencode规则转义。
+    片段不再合并，大字段值不会被再复制一份完整的请求体。
+    """
+    parts = []
+    length = 0
+    for key, value in fields.items():
+        if not isinstance(value, (bytes, bytearray)):
+            value = quote_plus(value).encode()
+        prefix = b"&" + key.encode() + b"=" if parts else key.encode() + b"="
+        parts.append(prefix)
+        parts.append(value)
+        length += len(prefix) + len(value)
+    return parts, length
+
+
+async def iter_form_parts(parts: List[bytes]):
+    """把form_body的片段逐个交给httpx写出"""
+    for part in parts:
+        yield part
+
+
+def ocr_cache_key(file_digest: str, fields: Dict[str, Any]) -> str:
+    """由上传文件的SHA-256和其余参数生成识别结果缓存键，文件字段只以参数名参与计算"""
+    params = orjson.dumps([
+        (key, None if isinstance(value, (bytes, bytearray)) else value) for key, value in fields.items()
+    ])
+    return f"ocr:cache:{hashlib.sha256(file_digest.encode() + b'|' + params).hexdigest()}"
 
 
 # Redis 键：
-#   rr:index                     -> 轮询计数器
 #   token:{client_id}            -> Hash { token, remaining, expire_ts }
 #   metrics:requests_total       -> 请求计数
 #   metrics:upstream_errors_total-> 上游错误计数
-#   monthly:{client_id}:{YYYY-MM} -> 月度使用计数
+#   monthly:{YYYY-MM}            -> Hash { client_id: 月度使用计数 }
 #   qps:{client_id}:{timestamp}  -> QPS 限制计数
+#   known_client_ids             -> Set 所有写入过 token/health 数据的 client_id
+#   ocr:cache:{sha256}           -> 相同上传文件和参数的百度原始响应
+
+# 一次调用原子地完成选择token、配额检查和预占（先计数再比较，超限时回退计数）：
+#   KEYS = [monthly:{YYYY-MM}, metrics:requests_total,
+#           token:{client_id_1}, qps:{client_id_1}:{timestamp}, token:{client_id_2}, ...]
+#   ARGV = [月配额, QPS限制, 月度计数过期时间戳, QPS计数过期秒数, 当前时间戳, client_id_1, client_id_2, ...]
+# 按顺序找到第一个token可用且未超限的密钥，预占一次配额后返回 {1, 密钥序号, token, 剩余次数}；
+# 全部失败返回 {0, 最后一次超限原因 'monthly'|'qps'|'', 没有可用token的密钥序号...}
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[5])
+local reason = ''
+local missing = {}
+for i = 6, #ARGV do
+    local cid = ARGV[i]
+    local token_key = KEYS[2 * i - 9]
+    local qps_key = KEYS[2 * i - 8]
+    local t = redis.call('HMGET', token_key, 'token', 'remaining', 'expire_ts')
+    local remaining = tonumber(t[2]) or 0
+    local expire_ts = tonumber(t[3]) or 0
+    if not t[1] or remaining <= 0 or (expire_ts > 0 and expire_ts <= now) then
+        missing[#missing + 1] = i - 5
+    else
+        local monthly = redis.call('HINCRBY', KEYS[1], cid, 1)
+        if monthly == 1 then
+            redis.call('EXPIREAT', KEYS[1], ARGV[3])
+        end
+        if monthly > tonumber(ARGV[1]) then
+            redis.call('HINCRBY', KEYS[1], cid, -1)
+            reason = 'monthly'
+        else
+            local qps = redis.call('INCR', qps_key)
+            if qps == 1 then
+                redis.call('EXPIRE', qps_key, ARGV[4])
+            end
+            if qps > tonumber(ARGV[2]) then
+                redis.call('DECR', qps_key)
+                redis.call('HINCRBY', KEYS[1], cid, -1)
+                reason = 'qps'
+            else
+                redis.call('INCR', KEYS[2])
+                remaining = redis.call('HINCRBY', token_key, 'remaining', -1)
+                return {1, i - 5, t[1], remaining}
+            end
+        end
+    end
+end
+return {0, reason, unpack(missing)}
+"""
+
+# 写入token哈希并设置TTL（同一条命令内完成，不会出现没有TTL的token哈希）：
+#   KEYS = [token:{client_id}, known_client_ids]
+#   ARGV = [client_id, token, 可用次数, 过期时间戳, TTL秒数（0表示不过期）]
+SAVE_TOKEN_SCRIPT = """
+redis.call('HSET', KEYS[1], 'token', ARGV[2], 'remaining', ARGV[3], 'expire_ts', ARGV[4])
+if tonumber(ARGV[5]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+end
+redis.call('SADD', KEYS[2], ARGV[1])
+"""
+
+# 把一条旧格式月度计数合并到月度哈希并删除（读取和删除在同一脚本内完成，多个进程同时迁移也只计入一次）：
+#   KEYS = [monthly:{client_id}:{YYYY-MM}, monthly:{YYYY-MM}]
+#   ARGV = [client_id]
+# 返回1表示本次迁移了该键，0表示已被其他进程迁移
+MIGRATE_MONTHLY_SCRIPT = """
+local usage = redis.call('GET', KEYS[1])
+if not usage then
+    return 0
+end
+local ttl = redis.call('TTL', KEYS[1])
+redis.call('DEL', KEYS[1])
+usage = tonumber(usage) or 0
+if usage ~= 0 then
+    redis.call('HINCRBY', KEYS[2], ARGV[1], usage)
+    if ttl > 0 then
+        redis.call('EXPIRE', KEYS[2], ttl)
+    end
+end
+return 1
+"""
+
+# 上游调用失败时退还acquire预占的配额：
+#   KEYS = [metrics:upstream_errors_total, acquire时的monthly:{YYYY-MM}, token:{client_id}]
+#   ARGV = [client_id, acquire取到的token, 是否作废token(1/0)]
+# 月度计数只在该月的哈希仍有此字段时回退，跨月或已清理时不会写出负数；
+# token哈希已被清理或刷新成新token时不做修改，避免多退次数或写出没有token和TTL的哈希
+RELEASE_SCRIPT = """
+redis.call('INCR', KEYS[1])
+if redis.call('HEXISTS', KEYS[2], ARGV[1]) == 1 then
+    redis.call('HINCRBY', KEYS[2], ARGV[1], -1)
+end
+if redis.call('HGET', KEYS[3], 'token') == ARGV[2] then
+    if ARGV[3] == '1' then
+        redis.call('HSET', KEYS[3], 'remaining', 0)
+    else
+        redis.call('HINCRBY', KEYS[3], 'remaining', 1)
+    end
+end
+"""
+
+
+# [缓存失效时间戳, 月份 YYYY-MM, 下月初时间戳]，跨月前一直复用，热路径上只做一次时间比较
+_month_cache: List[Any] = [0.0, "", 0]
+
+
+def current_month_window() -> Tuple[str, int]:
+    """返回当前月份 YYYY-MM 及月度计数的过期时间戳（本地时间下月初）"""
+    now = time.time()
+    if now >= _month_cache[0]:
+        lt = time.localtime(now)
+        year, month = (lt.tm_year + 1, 1) if lt.tm_mon == 12 else (lt.tm_year, lt.tm_mon + 1)
+        next_month_start = int(time.mktime((year, month, 1, 0, 0, 0, 0, 0, -1)))
+        _month_cache[:] = [next_month_start, f"{lt.tm_year:04d}-{lt.tm_mon:02d}", next_month_start]
+    return _month_cache[1], _month_cache[2]
+
+
+# 致命错误（密钥本身无效）的关键字，预编译为一个忽略大小写的正则，一次扫描完成匹配
+CRITICAL_ERROR_RE = re.compile(
+    r"invalid_client|invalid_secret|unknown client id|client_id not found", re.IGNORECASE
+)
 
 # ---------------------------
 # Token 管理器
@@ -134,97 +419,124 @@ class TokenManager:
                  qps_limit: int = 2, max_consecutive_errors: int = 3, health_check_interval: int = 3600):
         self.store = store
         self.keys = keys
+        # 按密钥序号排列的client_id及其Redis键名，热路径按下标取用而不是每次格式化字符串
+        self._client_ids: Tuple[str, ...] = tuple(key.client_id for key in keys)
+        self._token_keys: Tuple[str, ...] = tuple(f"token:{cid}" for cid in self._client_ids)
+        self._health_keys: Tuple[str, ...] = tuple(f"health:{cid}" for cid in self._client_ids)
         self.token_max_uses = token_max_uses
         self.monthly_quota_limit = monthly_quota_limit
         self.qps_limit = qps_limit
         # 健康检查配置
         self.max_consecutive_errors = max_consecutive_errors
         self.health_check_interval = health_check_interval
-
-    async def _get_healthy_keys(self) -> List[KeyItem]:
-        """获取健康的API密钥列表"""
-        healthy_keys = []
+        # 共享HTTP客户端，由应用启动时注入
+        self.http: Optional[httpx.AsyncClient] = None
+        # 健康密钥序号的进程内缓存 (序号列表, 读取时间)，Redis仍是健康状态的唯一来源
+        self._healthy_cache: Tuple[List[int], float] = ([], 0.0)
+        self._healthy_cache_ttl = 1.0
+        # 进程内轮询计数器，决定每次请求从哪个健康密钥开始尝试
+        self._rr_counter = itertools.count()
+        # 每个client_id一把刷新锁，避免token过期时并发请求同时向百度刷新
+        self._refresh_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # 后台执行的配额退还任务，保留强引用避免任务未完成就被回收
+        self._background_tasks: Set[asyncio.Task] = set()
+        # 配额检查与计数脚本，redis-py 使用 EVALSHA 调用，遇到 NOSCRIPT 时自动重新加载
+        self._acquire_script = store.client.register_script(ACQUIRE_SCRIPT)
+        self._save_token_script = store.client.register_script(SAVE_TOKEN_SCRIPT)
+        self._release_script = store.client.register_script(RELEASE_SCRIPT)
+
+    async def _get_healthy_indices(self) -> List[int]:
+        """获取健康API密钥的序号列表，1秒内复用上次读取的结果"""
+        cached_indices, cached_at = self._healthy_cache
+        if time.monotonic() - cached_at < self._healthy_cache_ttl:
+            return cached_indices
+        healthy_indices = await self._load_healthy_indices()
+        self._healthy_cache = (healthy_indices, time.monotonic())
+        return healthy_indices
+
+    def _invalidate_healthy_cache(self):
+        """本进程写入健康状态后立即失效缓存"""
+        self._healthy_cache = ([], 0.0)
+
+    async def _load_healthy_indices(self) -> List[int]:
+        """从Redis读取健康API密钥的序号列表"""
+        healthy_indices = []
+        retry_indices = []
         current_time = int(time.time())
 
-        for key in self.keys:
-            # 检查密钥是否被标记为不健康
-            health_key = f"health:{key.client_id}"
-            health_data = await self.store.client.hgetall(health_key)
+        # 一次pipeline读取所有密钥的健康状态
+        async with self.store.client.pipeline(transaction=False) as pipe:
+            for health_key in self._health_keys:
+                pipe.hgetall(health_key)
+            health_results = await pipe.execute()
 
+        for i, health_data in enumerate(health_results):
             if not health_data:
                 # 没有健康数据，认为是健康的
-                healthy_keys.append(key)
+                healthy_indices.append(i)
                 continue
 
-            decoded = {k.decode(): v.decode() for k, v in health_data.items()}
-            is_unhealthy = decoded.get("unhealthy", "false") == "true"
-            last_check = int(decoded.get("last_check", 0))
+            is_unhealthy = health_data.get("unhealthy", "false") == "true"
+            last_check = int(health_data.get("last_check", 0))
 
             if is_unhealthy:
                 # 检查是否到了重新尝试的时间
                 if current_time - last_check >= self.health_check_interval:
-                    # 重置健康状态，给它一次机会
-                    await self.store.client.hset(health_key, mapping={
+                    retry_indices.append(i)
+                    healthy_indices.append(i)
+            else:
+                healthy_indices.append(i)
+
+        if retry_indices:
+            # 重置健康状态，给它们一次机会
+            async with self.store.client.pipeline(transaction=False) as pipe:
+                for i in retry_indices:
+                    pipe.hset(self._health_keys[i], mapping={
                         "unhealthy": "false",
                         "consecutive_errors": "0",
                         "last_check": str(current_time)
                     })
-                    healthy_keys.append(key)
-            else:
-                healthy_keys.append(key)
-
-        return healthy_keys
-
-    async def _rr_pick_key(self) -> KeyItem:
-        # 优先从健康的密钥中选择
-        healthy_keys = await self._get_healthy_keys()
+                await pipe.execute()
 
-        if not healthy_keys:
-            # 如果没有健康的密钥，从所有密钥中选择（紧急情况）
-            healthy_keys = self.keys
+        return healthy_indices
 
-        if not healthy_keys:
-            raise HTTPException(status_code=500, detail="未配置任何 BAIDU_KEYS")
+    async def _record_key_error(self, key: KeyItem, error_msg: str, upstream_error: bool = False):
+        """记录API密钥错误，并检查是否需要标记为不健康
 
-        # 在健康密钥中轮询
-        idx = await self.store.client.incr("rr:healthy_index")
-        return healthy_keys[(idx - 1) % len(healthy_keys)]
-
-    async def _record_key_error(self, key: KeyItem, error_msg: str):
-        """记录API密钥错误，并检查是否需要标记为不健康"""
+        upstream_error为True时同时累加上游错误计数，与错误记录在同一次pipeline中写入。
+        """
         health_key = f"health:{key.client_id}"
         current_time = int(time.time())
 
-        # 获取当前错误计数
-        health_data = await self.store.client.hgetall(health_key)
-        if health_data:
-            decoded = {k.decode(): v.decode() for k, v in health_data.items()}
-            consecutive_errors = int(decoded.get("consecutive_errors", 0)) + 1
-        else:
-            consecutive_errors = 1
-
-        # 记录错误但不打印详细信息
+        # 检查是否需要标记为不健康
+        # 1. 连续错误达到阈值
+        # 2. 或者遇到致命错误（如invalid_client, invalid_secret等）
+        is_critical_error = CRITICAL_ERROR_RE.search(error_msg) is not None
 
-        # 更新错误计数
+        # 更新错误计数（HINCRBY直接返回累加后的连续错误次数，无需先读取）
         mapping = {
-            "consecutive_errors": str(consecutive_errors),
             "last_error": error_msg,
             "last_error_time": str(current_time)
         }
-
-        # 检查是否需要标记为不健康
-        # 1. 连续错误达到阈值
-        # 2. 或者遇到致命错误（如invalid_client, invalid_secret等）
-        is_critical_error = any(critical in error_msg.lower() for critical in [
-            "invalid_client", "invalid_secret", "unknown client id", "client_id not found"
-        ])
-        
-        if consecutive_errors >= self.max_consecutive_errors or is_critical_error:
+        if is_critical_error:
             mapping["unhealthy"] = "true"
             mapping["last_check"] = str(current_time)
-            # 标记为不健康
 
-        await self.store.client.hset(health_key, mapping=mapping)
+        async with self.store.client.pipeline(transaction=False) as pipe:
+            pipe.hincrby(health_key, "consecutive_errors", 1)
+            pipe.hset(health_key, mapping=mapping)
+            pipe.sadd("known_client_ids", key.client_id)
+            if upstream_error:
+                pipe.incrby("metrics:upstream_errors_total", 1)
+            consecutive_errors = (await pipe.execute())[0]
+
+        if consecutive_errors >= self.max_consecutive_errors and not is_critical_error:
+            # 标记为不健康
+            await self.store.client.hset(health_key, mapping={
+                "unhealthy": "true",
+                "last_check": str(current_time)
+            })
+        self._invalidate_healthy_cache()
 
     async def _record_key_success(self, key: KeyItem):
         """记录API密钥成功，重置错误计数"""
@@ -232,11 +544,15 @@ class TokenManager:
         current_time = int(time.time())
 
         # 重置错误计数和健康状态
-        await self.store.client.hset(health_key, mapping={
-            "consecutive_errors": "0",
-            "unhealthy": "false",
-            "last_success": str(current_time)
-        })
+        async with self.store.client.pipeline(transaction=False) as pipe:
+            pipe.hset(health_key, mapping={
+                "consecutive_errors": "0",
+                "unhealthy": "false",
+                "last_success": str(current_time)
+            })
+            pipe.sadd("known_client_ids", key.client_id)
+            await pipe.execute()
+        self._invalidate_healthy_cache()
 
     async def _fetch_new_token(self, key: KeyItem) -> Tuple[str, Optional[int]]:
         params = {
@@ -245,16 +561,16 @@ class TokenManager:
             "client_secret": key.client_secret,
         }
         try:
-            async with httpx.AsyncClient(timeout=15) as client:
-                r = await client.post(settings.baidu_token_url, params=params, headers={"Accept": "application/json"})
+            r = await self.http.post(
+                hot_settings.baidu_token_url, params=params, headers={"Accept": "application/json"}, timeout=15
+            )
 
             if r.status_code != 200:
                 error_msg = f"HTTP {r.status_code}: {r.text}"
-                await self._record_key_error(key, error_msg)
-                await self.store.client.incrby("metrics:upstream_errors_total", 1)
+                await self._record_key_error(key, error_msg, upstream_error=True)
                 raise HTTPException(status_code=502, detail=f"获取 token 失败: {error_msg}")
 
-            data = r.json()
+            data = orjson.loads(r.content)
             access_token = data.get("access_token")
             expires_in = data.get("expires_in")  # 秒
 
@@ -278,135 +594,169 @@ class TokenManager:
 
     async def _save_token(self, key: KeyItem, token: str, ttl_seconds: Optional[int]):
         expire_ts = int(time.time()) + (ttl_seconds or 0)
-        pipe = self.store.client.pipeline()
-        await pipe.hset(f"token:{key.client_id}", mapping={
-            "token": token,
-            "remaining": self.token_max_uses,
-            "expire_ts": expire_ts,
-        })
-        if ttl_seconds:
-            await pipe.expire(
-                f"token:{key.client_id}",
-                ttl_seconds - 30 if ttl_seconds > 60 else ttl_seconds
-            )
-        await pipe.execute()
+        ttl = (ttl_seconds - 30 if ttl_seconds > 60 else ttl_seconds) if ttl_seconds else 0
+        await self._save_token_script(
+            keys=[f"token:{key.client_id}", "known_client_ids"],
+            args=[key.client_id, token, self.token_max_uses, expire_ts, ttl],
+        )
 
-    async def _get_cached(self, key: KeyItem) -> Optional[Dict[str, Any]]:
-        data = await self.store.client.hgetall(f"token:{key.client_id}")
+    @staticmethod
+    def _usable_token(data: Dict[str, str]) -> Optional[Dict[str, str]]:
+        """解析token数据，剩余次数用完或已过期时返回None"""
         if not data:
             return None
-        decoded = {k.decode(): v.decode() for k, v in data.items()}
-        remaining = int(decoded.get("remaining", 0))
-        expire_ts = int(decoded.get("expire_ts", 0))
+        remaining = int(data.get("remaining", 0))
+        expire_ts = int(data.get("expire_ts", 0))
         if remaining <= 0:
             return None
         if expire_ts and expire_ts <= int(time.time()):
             return None
-        return decoded
-
-    async def _decrement_use(self, key: KeyItem):
-        # 防止并发导致remaining变成负数
-        pipe = self.store.client.pipeline()
-        await pipe.hincrby(f"token:{key.client_id}", "remaining", -1)
-        await pipe.hget(f"token:{key.client_id}", "remaining")
-        _, remaining_bytes = await pipe.execute()
-        
-        # 如果变成负数，将其重置为0
-        if remaining_bytes and int(remaining_bytes) < 0:
-            await self.store.client.hset(f"token:{key.client_id}", mapping={"remaining": "0"})
+        return data
+
+    async def _refresh_token(self, key: KeyItem) -> str:
+        """刷新指定密钥的token，同一client_id的并发刷新只请求一次百度接口"""
+        async with self._refresh_locks[key.client_id]:
+            # 等锁期间其他协程可能已经刷新完成
+            cached = self._usable_token(await self.store.client.hgetall(f"token:{key.client_id}"))
+            if cached:
+                return cached["token"]
+            token, ttl = await self._fetch_new_token(key)
+            await self._save_token(key, token, ttl)
+            return token
+
+    async def _rotated_healthy_indices(self) -> List[int]:
+        """健康密钥序号列表，每次调用从不同的密钥开始，避免总是优先消耗第一个密钥"""
+        healthy_indices = await self._get_healthy_indices()
+        if not healthy_indices:
+            return healthy_indices
+        offset = next(self._rr_counter) % len(healthy_indices)
+        return healthy_indices[offset:] + healthy_indices[:offset]
 
     async def get_token(self) -> Tuple[str, KeyItem]:
-        # 先尽量复用现有可用 token，减少刷新频率
-        healthy_keys = await self._get_healthy_keys()
-        for key in healthy_keys:
-            cached = await self._get_cached(key)
+        # 先尽量复用现有可用 token，减少刷新频率（一次pipeline读取所有健康密钥的token）
+        healthy_indices = await self._rotated_healthy_indices()
+        async with self.store.client.pipeline(transaction=False) as pipe:
+            for i in healthy_indices:
+                pipe.hgetall(self._token_keys[i])
+            token_results = await pipe.execute()
+        for i, token_data in zip(healthy_indices, token_results):
+            cached = self._usable_token(token_data)
             if cached:
-                return cached["token"], key
+                return cached["token"], self.keys[i]
         
         # 尝试获取新token，按顺序尝试每个健康密钥
-        for key in healthy_keys:
+        for i in healthy_indices:
             try:
-                token, ttl = await self._fetch_new_token(key)
-                await self._save_token(key, token, ttl)
-                return token, key
+                return await self._refresh_token(self.keys[i]), self.keys[i]
             except HTTPException:
                 # token获取失败，该密钥已经在_fetch_new_token中被标记为不健康
                 # 继续尝试下一个密钥
                 continue
         
         # 如果所有健康密钥都失败了，尝试所有密钥（紧急情况）
-        remaining_keys = [key for key in self.keys if key not in healthy_keys]
-        for key in remaining_keys:
+        remaining_indices = [i for i in range(len(self.keys)) if i not in healthy_indices]
+        for i in remaining_indices:
             try:
-                token, ttl = await self._fetch_new_token(key)
-                await self._save_token(key, token, ttl)
-                return token, key
+                return await self._refresh_token(self.keys[i]), self.keys[i]
             except HTTPException:
                 continue
         
         # 所有密钥都失败
         raise HTTPException(status_code=502, detail="所有API密钥都无法获取token")
 
-    async def _check_monthly_quota(self, key: KeyItem) -> bool:
-        """检查月配额是否超限"""
-        current_month = time.strftime("%Y-%m")
-        monthly_key = f"monthly:{key.client_id}:{current_month}"
-        current_usage = await self.store.client.get(monthly_key)
-        current_usage = int(current_usage) if current_usage else 0
-        return current_usage < self.monthly_quota_limit
-
-    async def _check_qps_limit(self, key: KeyItem) -> bool:
-        """检查QPS限制"""
-        current_second = int(time.time())
-        qps_key = f"qps:{key.client_id}:{current_second}"
-        current_qps = await self.store.client.get(qps_key)
-        current_qps = int(current_qps) if current_qps else 0
-        return current_qps < self.qps_limit
-
-    async def _increment_monthly_usage(self, key: KeyItem):
-        """增加月度使用计数"""
-        current_month = time.strftime("%Y-%m")
-        monthly_key = f"monthly:{key.client_id}:{current_month}"
-        pipe = self.store.client.pipeline()
-        await pipe.incr(monthly_key)
-        # 设置过期时间为下个月初（使用UTC时间避免时区问题）
-        now = datetime.datetime.now(datetime.timezone.utc)
-        year = now.year + (1 if now.month == 12 else 0)
-        month = 1 if now.month == 12 else now.month + 1
-        expire_at = calendar.timegm(datetime.datetime(year, month, 1).timetuple())
-        await pipe.expireat(monthly_key, expire_at)
-        await pipe.execute()
-
-    async def _increment_qps_usage(self, key: KeyItem):
-        """增加QPS计数"""
-        current_second = int(time.time())
-        qps_key = f"qps:{key.client_id}:{current_second}"
-        pipe = self.store.client.pipeline()
-        await pipe.incr(qps_key)
-        await pipe.expire(qps_key, 2)  # 2秒后过期
-        await pipe.execute()
-
-    async def consume(self, key: KeyItem):
-        """消费一次token使用，包含配额检查"""
-        # 检查月配额
-        if not await self._check_monthly_quota(key):
-            raise HTTPException(status_code=429, detail=f"月配额已用完 (限制: {self.monthly_quota_limit}次/月)")
+    async def _try_acquire(self, indices: List[int]) -> Tuple[List[Any], str]:
+        """执行一次预占脚本，返回 (脚本结果, 本次计数所用的月度键)"""
+        current_month, month_expire_at = current_month_window()
+        now = int(time.time())
+        monthly_key = f"monthly:{current_month}"
+        script_keys = [monthly_key, "metrics:requests_total"]
+        for i in indices:
+            script_keys.append(self._token_keys[i])
+            script_keys.append(f"qps:{self._client_ids[i]}:{now}")
+        result = await self._acquire_script(
+            keys=script_keys,
+            args=[self.monthly_quota_limit, self.qps_limit, month_expire_at, 2, now,
+                  *(self._client_ids[i] for i in indices)],
+        )
+        return result, monthly_key
 
-        # 检查QPS限制
-        if not await self._check_qps_limit(key):
+    async def acquire(self) -> Tuple[str, KeyItem, int, str]:
+        """选择可用token并预占一次月配额、QPS和使用次数，返回 (token, 密钥, 剩余次数, 月度键)
+
+        正常情况下只需一次脚本调用；调用上游失败时需把token和月度键传给release退还预占的配额。
+        """
+        healthy_indices = await self._rotated_healthy_indices()
+        result, monthly_key = await self._try_acquire(healthy_indices)
+        if result[0] == 1:
+            return result[2], self.keys[healthy_indices[result[1] - 1]], result[3], monthly_key
+
+        # 没有可用token的健康密钥依次刷新
+        reason = result[1]
+        for i in (healthy_indices[n - 1] for n in result[2:]):
+            try:
+                await self._refresh_token(self.keys[i])
+            except HTTPException:
+                # token获取失败，该密钥已经在_fetch_new_token中被标记为不健康
+                continue
+            result, monthly_key = await self._try_acquire([i])
+            if result[0] == 1:
+                return result[2], self.keys[i], result[3], monthly_key
+            reason = result[1] or reason
+
+        # 只有健康密钥都拿不到token时才启用不健康密钥（紧急情况）；
+        # 健康密钥只是触发月配额/QPS限制时直接返回429，不去刷新不健康密钥
+        if not reason:
+            for i in range(len(self.keys)):
+                if i in healthy_indices:
+                    continue
+                try:
+                    await self._refresh_token(self.keys[i])
+                except HTTPException:
+                    continue
+                result, monthly_key = await self._try_acquire([i])
+                if result[0] == 1:
+                    return result[2], self.keys[i], result[3], monthly_key
+                reason = result[1] or reason
+
+        if reason == "monthly":
+            raise HTTPException(status_code=429, detail=f"月配额已用完 (限制: {self.monthly_quota_limit}次/月)")
+        if reason == "qps":
             raise HTTPException(status_code=429, detail=f"QPS限制 (限制: {self.qps_limit}次/秒)")
+        raise HTTPException(status_code=502, detail="所有API密钥都无法获取token")
 
-        # 正常消费
-        await self._decrement_use(key)
-        await self._increment_monthly_usage(key)
-        await self._increment_qps_usage(key)
+    async def release(self, key: KeyItem, token: str, monthly_key: str, invalidate_token: bool = False):
+        """上游调用失败时退还acquire预占的月配额和使用次数，并记录上游错误
+
+        401/400时视为token失效，把remaining置0强制下次刷新；token已被刷新或清理时不做修改。
+        """
+        await self._release_script(
+            keys=["metrics:upstream_errors_total", monthly_key, f"token:{key.client_id}"],
+            args=[key.client_id, token, 1 if invalidate_token else 0],
+        )
+
+    def release_in_background(self, key: KeyItem, token: str, monthly_key: str, invalidate_token: bool = False):
+        """在后台任务中执行release，上游出错时不必等Redis写完再返回502"""
+        task = asyncio.create_task(self.release(key, token, monthly_key, invalidate_token))
+        self._background_tasks.add(task)
+
+        def _on_done(done_task: asyncio.Task):
+            self._background_tasks.discard(done_task)
+            if not done_task.cancelled() and done_task.exception() is not None:
+                print(f"退还配额失败 {key.client_id}: {done_task.exception()}")
+
+        task.add_done_callback(_on_done)
+
+    async def wait_background_tasks(self):
+        """等待尚未完成的后台任务，关闭Redis连接前调用"""
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
 
 
 # ---------------------------
 # FastAPI 应用
 # ---------------------------
 
-store = RedisStore(settings.redis_url, settings.redis_password)
+store = RedisStore(settings.redis_url, settings.redis_password, max_connections=settings.redis_max_connections)
 manager = TokenManager(store, settings.baidu_keys, settings.token_max_uses, settings.monthly_quota_limit,
                        settings.qps_limit, settings.max_consecutive_errors, settings.health_check_interval)
 
@@ -427,7 +777,7 @@ def verify_api_key(
     2. Header: X-API-Key: <API_KEY>
     3. Header: API-Key: <API_KEY>
     """
-    if not settings.api_key:
+    if not hot_settings.api_key:
         # 如果未配置API_KEY，则不进行校验
         return True
 
@@ -450,7 +800,7 @@ def verify_api_key(
             }
         )
 
-    if provided_key != settings.api_key:
+    if provided_key != hot_settings.api_key:
         raise HTTPException(
             status_code=401,
             detail={
@@ -463,6 +813,28 @@ def verify_api_key(
     return True
 
 
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    """共享HTTP客户端依赖"""
+    return request.app.state.http
+
+
+async def seed_known_client_ids(store: RedisStore) -> int:
+    """把已有 token/health/月度数据中的 client_id 补登记到 known_client_ids，返回新增数量
+
+    known_client_ids 引入之前写入的数据不在集合中，启动时用SCAN补齐一次，
+    管理面板才能继续列出已删除密钥的数据。
+    """
+    client_ids = set()
+    for pattern in ("token:*", "health:*"):
+        async for key in store.client.scan_iter(match=pattern, count=1000):
+            client_ids.add(key.split(":", 1)[1])
+    async for key in store.client.scan_iter(match="monthly:*", count=1000, _type="hash"):
+        client_ids.update(await store.client.hkeys(key))
+    if not client_ids:
+        return 0
+    return await store.client.sadd("known_client_ids", *client_ids)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
@@ -492,14 +864,30 @@ async def lifespan(app: FastAPI):
         print(f"   BAIDU_GENERAL_OCR_URL: {settings.baidu_general_ocr_url}")
     print("=" * 50)
 
+    # 共享HTTP客户端，整个进程生命周期内复用连接
+    app.state.http = create_http_client()
+    manager.http = app.state.http
+
     try:
         await store.client.ping()
         print("[startup] Redis 连接成功")
 
-        # 清理 Redis 里的 token 缓存和轮询索引 - 这块不需要的时候可以注释掉
-        async for key in store.client.scan_iter("token:*"):
-            await store.client.delete(key)
-        await store.client.delete("rr:index")
+        # 将旧格式的月度计数 monthly:{client_id}:{YYYY-MM} 合并到 monthly:{YYYY-MM} 哈希
+        migrated = 0
+        migrate_monthly = store.client.register_script(MIGRATE_MONTHLY_SCRIPT)
+        async for legacy_key in store.client.scan_iter("monthly:*:*", _type="string"):
+            _, client_id, month = legacy_key.split(":", 2)
+            migrated += await migrate_monthly(keys=[legacy_key, f"monthly:{month}"], args=[client_id])
+        if migrated:
+            print(f"[startup] 已迁移 {migrated} 条旧格式月度使用记录")
+
+        # 在清理token之前登记已有数据的client_id
+        seeded = await seed_known_client_ids(store)
+        if seeded:
+            print(f"[startup] 已登记 {seeded} 个历史 client_id")
+
+        # 清理 Redis 里的 token 缓存 - 这块不需要的时候可以注释掉
+        await store.unlink_matching("token:*")
         print("[startup] 已清理 Redis 中的 token 缓存")
 
     except Exception as e:
@@ -508,16 +896,66 @@ async def lifespan(app: FastAPI):
     yield
 
     # Shutdown
+    await app.state.http.aclose()
+    await manager.wait_background_tasks()
     await store.close()
 
 
-app = FastAPI(title="百度 AIP 代理服务", version="1.0", lifespan=lifespan)
+class ORJSONResponse(JSONResponse):
+    """使用orjson序列化的JSON响应"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+# 上传文件大小限制 (4MB，符合百度API要求)
+MAX_UPLOAD_SIZE = 4 * 1024 * 1024
+# multipart边界和表单头的余量
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadSizeLimitMiddleware:
+    """在解析multipart之前按Content-Length拒绝超大的上传请求，避免先把整个请求体读进来"""
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is not None:
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    try:
+                        size = int(value)
+                    except ValueError:
+                        response = ORJSONResponse(status_code=400, content={"detail": "Content-Length 格式错误"})
+                        await response(scope, receive, send)
+                        return
+                    if size > limit + MULTIPART_OVERHEAD:
+                        response = ORJSONResponse(status_code=400, content={
+                            "detail": f"文件大小超过限制。最大允许: {limit // (1024 * 1024)}MB，当前文件: {size // (1024 * 1024)}MB"
+                        })
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+
+app = FastAPI(title="百度 AIP 代理服务", version="1.0", default_response_class=ORJSONResponse, lifespan=lifespan)
+# /ocr/upload_smart 的表单里可能直接带base64字段，不按文件大小限制请求体
+app.add_middleware(UploadSizeLimitMiddleware, limits={"/ocr/upload": MAX_UPLOAD_SIZE})
 
 
 # ---------------------------
 # Pydantic 模型
 # ---------------------------
 
+# 开关类参数（验真/置信度/坐标）的合法取值
+BOOL_STRINGS = frozenset({"true", "false"})
+
+
 class HealthResponse(BaseModel):
     status: str
     redis_ok: bool
@@ -546,7 +984,7 @@ class OCRUploadRequest(BaseModel):
 
     @classmethod
     def _validate_bool_string(cls, v):
-        if v is not None and v not in ["true", "false"]:
+        if v is not None and v not in BOOL_STRINGS:
             raise ValueError("参数值必须为 'true' 或 'false'")
         return v
 
@@ -564,8 +1002,10 @@ class OCRUploadRequest(BaseModel):
 
 class OCRResponse(BaseModel):
     baidu_raw: Dict[str, Any]
-    used_key: str
+    # 命中识别结果缓存时没有使用密钥，used_key和remaining_estimate为空
+    used_key: Optional[str] = None
     remaining_estimate: Optional[int] = None
+    cached: bool = False
 
 
 # ---------------------------
@@ -576,14 +1016,21 @@ class OCRResponse(BaseModel):
 #  手动清理Token缓存接口
 @app.post("/clear_tokens", dependencies=[Depends(verify_api_key)])
 async def clear_tokens():
-    deleted = 0
-    async for key in store.client.scan_iter("token:*"):
-        deleted += await store.client.delete(key)
-    await store.client.delete("rr:index")
-    await store.client.delete("rr:healthy_index")
+    deleted = await store.unlink_matching("token:*")
     return {"status": "ok", "deleted": deleted}
 
 
+# 健康检查结果只取决于Redis是否可达，两种响应启动时预先序列化，探针请求直接复用
+HEALTH_RESPONSES = {
+    redis_ok: ORJSONResponse({
+        "status": "ok" if redis_ok and bool(hot_settings.baidu_keys) else "degraded",
+        "redis_ok": redis_ok,
+        "keys_loaded": len(hot_settings.baidu_keys),
+    })
+    for redis_ok in (True, False)
+}
+
+
 @app.get("/health", response_model=HealthResponse)
 async def health():
     redis_ok = True
@@ -591,11 +1038,7 @@ async def health():
         await store.client.ping()
     except Exception:
         redis_ok = False
-    return HealthResponse(
-        status="ok" if redis_ok and bool(settings.baidu_keys) else "degraded",
-        redis_ok=redis_ok,
-        keys_loaded=len(settings.baidu_keys),
-    )
+    return HEALTH_RESPONSES[redis_ok]
 
 
 @app.post("/token/refresh")
@@ -606,7 +1049,7 @@ async def token_refresh(api_key_valid: bool = Depends(verify_api_key)):
         "client_id": key.client_id,
         "access_token": token,
         "expires_in": None,  # get_token返回的token可能是缓存的，没有TTL信息
-        "remaining": settings.token_max_uses,
+        "remaining": hot_settings.token_max_uses,
     }
 
 
@@ -614,10 +1057,10 @@ async def token_refresh(api_key_valid: bool = Depends(verify_api_key)):
 async def token_state(api_key_valid: bool = Depends(verify_api_key)):
     items = []
     now = int(time.time())
-    for key in settings.baidu_keys:
+    for key in hot_settings.baidu_keys:
         data = await store.client.hgetall(f"token:{key.client_id}")
         if data:
-            d = {k.decode(): v.decode() for k, v in data.items()}
+            d: Dict[str, Any] = dict(data)
             d["client_id"] = key.client_id
             if "expire_ts" in d:
                 d["time_left_s"] = max(0, int(d["expire_ts"]) - now)
@@ -635,40 +1078,45 @@ async def token_state(api_key_valid: bool = Depends(verify_api_key)):
 @app.get("/quota/status")
 async def quota_status(api_key_valid: bool = Depends(verify_api_key)):
     """查看配额使用情况"""
-    current_month = time.strftime("%Y-%m")
+    current_month, _ = current_month_window()
+    current_second = int(time.time())
     quota_info = []
 
-    for key in settings.baidu_keys:
+    # 一次pipeline读取本月使用量以及每个密钥的QPS、token和健康状态
+    async with store.client.pipeline(transaction=False) as pipe:
+        pipe.hgetall(f"monthly:{current_month}")
+        for key in hot_settings.baidu_keys:
+            pipe.get(f"qps:{key.client_id}:{current_second}")
+            pipe.hgetall(f"token:{key.client_id}")
+            pipe.hgetall(f"health:{key.client_id}")
+        results = await pipe.execute()
+    monthly_data = results[0]
+
+    for i, key in enumerate(hot_settings.baidu_keys):
+        current_qps, token_data, health_data = results[1 + i * 3:4 + i * 3]
+
         # 获取月度使用量
-        monthly_key = f"monthly:{key.client_id}:{current_month}"
-        monthly_usage = await store.client.get(monthly_key)
+        monthly_usage = monthly_data.get(key.client_id)
         monthly_usage = int(monthly_usage) if monthly_usage else 0
 
         # 获取当前QPS
-        current_second = int(time.time())
-        qps_key = f"qps:{key.client_id}:{current_second}"
-        current_qps = await store.client.get(qps_key)
         current_qps = int(current_qps) if current_qps else 0
 
         # 获取token状态
-        token_data = await store.client.hgetall(f"token:{key.client_id}")
         if token_data:
-            decoded = {k.decode(): v.decode() for k, v in token_data.items()}
-            remaining_uses = int(decoded.get("remaining", 0))
-            expire_ts = int(decoded.get("expire_ts", 0))
+            remaining_uses = int(token_data.get("remaining", 0))
+            expire_ts = int(token_data.get("expire_ts", 0))
             days_left = max(0, (expire_ts - int(time.time())) // (24 * 3600)) if expire_ts else 0
         else:
             remaining_uses = 0
             days_left = 0
 
         # 获取健康状态
-        health_data = await store.client.hgetall(f"health:{key.client_id}")
         if health_data:
-            health_decoded = {k.decode(): v.decode() for k, v in health_data.items()}
-            is_healthy = health_decoded.get("unhealthy", "false") != "true"
-            consecutive_errors = int(health_decoded.get("consecutive_errors", 0))
-            last_error = health_decoded.get("last_error", "")
-            last_success = health_decoded.get("last_success", "")
+            is_healthy = health_data.get("unhealthy", "false") != "true"
+            consecutive_errors = int(health_data.get("consecutive_errors", 0))
+            last_error = health_data.get("last_error", "")
+            last_success = health_data.get("last_success", "")
         else:
             is_healthy = True
             consecutive_errors = 0
@@ -678,12 +1126,12 @@ async def quota_status(api_key_valid: bool = Depends(verify_api_key)):
         quota_info.append({
             "client_id": key.client_id,
             "monthly_usage": monthly_usage,
-            "monthly_limit": settings.monthly_quota_limit,
-            "monthly_remaining": settings.monthly_quota_limit - monthly_usage,
+            "monthly_limit": hot_settings.monthly_quota_limit,
+            "monthly_remaining": hot_settings.monthly_quota_limit - monthly_usage,
             "current_qps": current_qps,
-            "qps_limit": settings.qps_limit,
+            "qps_limit": hot_settings.qps_limit,
             "token_remaining_uses": remaining_uses,
-            "token_max_uses": settings.token_max_uses,
+            "token_max_uses": hot_settings.token_max_uses,
             "token_days_left": days_left,
             "health": {
                 "is_healthy": is_healthy,
@@ -692,8 +1140,8 @@ async def quota_status(api_key_valid: bool = Depends(verify_api_key)):
                 "last_success": last_success
             },
             "status": {
-                "monthly_ok": monthly_usage < settings.monthly_quota_limit,
-                "qps_ok": current_qps < settings.qps_limit,
+                "monthly_ok": monthly_usage < hot_settings.monthly_quota_limit,
+                "qps_ok": current_qps < hot_settings.qps_limit,
                 "token_ok": remaining_uses > 0 and days_left > 0,
                 "health_ok": is_healthy
             }
@@ -704,7 +1152,7 @@ async def quota_status(api_key_valid: bool = Depends(verify_api_key)):
         "quota_details": quota_info,
         "summary": {
             "total_monthly_usage": sum(item["monthly_usage"] for item in quota_info),
-            "total_monthly_limit": len(quota_info) * settings.monthly_quota_limit,
+            "total_monthly_limit": len(quota_info) * hot_settings.monthly_quota_limit,
             "total_keys": len(quota_info),
             "healthy_keys": sum(1 for item in quota_info if item["health"]["is_healthy"]),
             "unhealthy_keys": sum(1 for item in quota_info if not item["health"]["is_healthy"]),
@@ -713,13 +1161,72 @@ async def quota_status(api_key_valid: bool = Depends(verify_api_key)):
     }
 
 
+# 上传接口允许的文件类型，upload_smart额外支持OFD
+UPLOAD_CONTENT_TYPES = frozenset({
+    'image/jpeg', 'image/jpg', 'image/png', 'image/bmp',
+    'image/gif', 'image/webp', 'application/pdf'
+})
+SMART_UPLOAD_CONTENT_TYPES = UPLOAD_CONTENT_TYPES | {'application/ofd'}
+UPLOAD_CONTENT_TYPES_TEXT = ', '.join(sorted(UPLOAD_CONTENT_TYPES))
+SMART_UPLOAD_CONTENT_TYPES_TEXT = ', '.join(sorted(SMART_UPLOAD_CONTENT_TYPES))
+# 文件类型对应的百度接口参数名，其余（图片）使用 image 参数
+CONTENT_TYPE_FIELDS = {'application/pdf': 'pdf_file', 'application/ofd': 'ofd_file'}
+
+
+async def forward_ocr(http: httpx.AsyncClient, data: Dict[str, Any],
+                      file_digest: Optional[str] = None) -> Response:
+    """预占配额后调用百度OCR接口，上游失败时退还预占的配额
+
+    file_digest为上传文件的SHA-256（仅在开启缓存时计算），相同文件和参数的请求
+    直接返回缓存的百度结果，不预占配额也不请求百度。URL识别的内容可能变化，不缓存。
+    """
+    cache_key = None
+    if file_digest is not None:
+        cache_key = ocr_cache_key(file_digest, data)
+        cached = await store.client.get(cache_key)
+        if cached is not None:
+            return Response(
+                content='{"baidu_raw":' + cached + ',"used_key":null,"remaining_estimate":null,"cached":true}',
+                media_type="application/json",
+            )
+
+    token, key, remaining, monthly_key = await manager.acquire()
+    parts, length = form_body(data)
+    # 请求体按片段流式写出，预先算好的Content-Length避免退化为chunked编码
+    headers = {**FORM_HEADERS, "content-length": str(length)}
+    try:
+        r = await http.post(OCR_URL_PREFIX + token, content=iter_form_parts(parts), headers=headers)
+    except httpx.HTTPError as e:
+        manager.release_in_background(key, token, monthly_key)
+        raise HTTPException(status_code=502, detail=f"上游 OCR 请求失败: {e}")
+
+    if r.status_code != 200:
+        manager.release_in_background(key, token, monthly_key, invalidate_token=r.status_code in (400, 401))
+        raise HTTPException(status_code=502, detail=f"上游 OCR 错误: {r.status_code} {r.text}")
+
+    # 只校验上游返回的是JSON对象，响应体直接拼接原始字节（结构同OCRResponse），省去模型校验和重新序列化
+    try:
+        baidu_raw = orjson.loads(r.content)
+    except orjson.JSONDecodeError:
+        baidu_raw = None
+    if not isinstance(baidu_raw, dict):
+        raise HTTPException(status_code=502, detail=f"上游 OCR 返回格式错误: {r.text[:200]}")
+    content = (b'{"baidu_raw":' + r.content + b',"used_key":' + orjson.dumps(key.client_id)
+               + b',"remaining_estimate":' + orjson.dumps(remaining) + b',"cached":false}')
+    # 百度在HTTP 200中也会返回error_code，只缓存识别成功的结果
+    if cache_key is not None and "error_code" not in baidu_raw:
+        await store.client.set(cache_key, r.content, ex=hot_settings.ocr_cache_ttl)
+    return Response(content=content, media_type="application/json")
+
+
 @app.post("/ocr/url", response_model=OCRResponse)
 async def ocr_url_recognition(
         url: str = Form(..., description="图片完整URL，长度不超过1024字节"),
         verify_parameter: Optional[str] = Form(None, description="是否开启验真（true/false）"),
         probability: Optional[str] = Form(None, description="是否返回置信度（true/false）"),
         location: Optional[str] = Form(None, description="是否返回坐标（true/false）"),
-        api_key_valid: bool = Depends(verify_api_key)
+        api_key_valid: bool = Depends(verify_api_key),
+        http: httpx.AsyncClient = Depends(get_http_client)
 ):
     # 验证URL长度
     if len(url) > 1024:
@@ -728,9 +1235,6 @@ async def ocr_url_recognition(
             detail="URL长度超过限制，最大允许1024字节"
         )
 
-    # 获取token
-    token, key = await manager.get_token()
-
     # 构建请求数据
     data = {"url": url}
 
@@ -742,96 +1246,31 @@ async def ocr_url_recognition(
     if location is not None:
         data["location"] = location
 
-    # 调用百度OCR API
-    async with httpx.AsyncClient(timeout=30) as client:
-        api_url = f"{settings.baidu_ocr_url}?access_token={token}"
-        r = await client.post(
-            api_url,
-            data=data,
-            headers={"content-type": "application/x-www-form-urlencoded"}
-        )
-
-    await store.client.incrby("metrics:requests_total", 1)
-
-    if r.status_code != 200:
-        await store.client.incrby("metrics:upstream_errors_total", 1)
-        # 401/400：视为token失效，立即将remaining置0强制下次刷新
-        if r.status_code in (400, 401):
-            await store.client.hset(f"token:{key.client_id}", mapping={"remaining": 0})
-        raise HTTPException(status_code=502, detail=f"上游OCR错误: {r.status_code} {r.text}")
-
-    # 正常扣减一次使用次数
-    await manager.consume(key)
-
-    raw = r.json()
-    remaining = await store.client.hget(f"token:{key.client_id}", "remaining")
-    remaining_int: Optional[int] = int(remaining) if remaining is not None else None
-
-    return OCRResponse(baidu_raw=raw, used_key=key.client_id, remaining_estimate=remaining_int)
+    # 调用百度 OCR API
+    return await forward_ocr(http, data)
 
 
 @app.post("/ocr/upload", response_model=OCRResponse)
-async def ocr_upload_file(file: UploadFile = File(...), api_key_valid: bool = Depends(verify_api_key)):
-    allowed_types = {
-        'image/jpeg', 'image/jpg', 'image/png', 'image/bmp',
-        'image/gif', 'image/webp', 'application/pdf'
-    }
+async def ocr_upload_file(
+        file: UploadFile = File(...),
+        api_key_valid: bool = Depends(verify_api_key),
+        http: httpx.AsyncClient = Depends(get_http_client)
+):
 
-    if file.content_type not in allowed_types:
+    if file.content_type not in UPLOAD_CONTENT_TYPES:
         raise HTTPException(
             status_code=400,
-            detail=f"不支持的文件类型: {file.content_type}。支持的类型: {', '.join(allowed_types)}"
+            detail=f"不支持的文件类型: {file.content_type}。支持的类型: {UPLOAD_CONTENT_TYPES_TEXT}"
         )
 
-    # 检查文件大小 (限制为 4MB，符合百度API要求)
-    max_size = 4 * 1024 * 1024  # 4MB
-    file_content = await file.read()
+    # 检查文件大小 (限制为 4MB，符合百度API要求)，边读取边base64编码
+    file_base64, file_digest = await read_form_base64(file, MAX_UPLOAD_SIZE)
 
-    if len(file_content) > max_size:
-        raise HTTPException(
-            status_code=400,
-            detail=f"文件大小超过限制。最大允许: {max_size // (1024 * 1024)}MB，当前文件: {len(file_content) // (1024 * 1024)}MB"
-        )
-
-    # 获取 token
-    token, key = await manager.get_token()
-
-    # 准备数据 - 根据文件类型使用不同参数
-    if file.content_type == 'application/pdf':
-        # PDF文件使用 pdf_file 参数
-        data = {
-            "pdf_file": base64.b64encode(file_content).decode(),
-        }
-    else:
-        # 图片文件使用 image 参数
-        data = {
-            "image": base64.b64encode(file_content).decode(),
-        }
+    # 准备数据 - 根据文件类型使用不同参数（PDF文件使用 pdf_file，图片使用 image）
+    data = {CONTENT_TYPE_FIELDS.get(file.content_type, "image"): file_base64}
 
     # 调用百度 OCR API
-    async with httpx.AsyncClient(timeout=30) as client:
-        url = f"{settings.baidu_ocr_url}?access_token={token}"
-        r = await client.post(
-            url, data=data, headers={"content-type": "application/x-www-form-urlencoded"}
-        )
-
-    await store.client.incrby("metrics:requests_total", 1)
-
-    if r.status_code != 200:
-        await store.client.incrby("metrics:upstream_errors_total", 1)
-        # 401/400：视为 token 失效，立即将 remaining 置 0 强制下次刷新
-        if r.status_code in (400, 401):
-            await store.client.hset(f"token:{key.client_id}", mapping={"remaining": 0})
-        raise HTTPException(status_code=502, detail=f"上游 OCR 错误: {r.status_code} {r.text}")
-
-    # 正常扣减一次使用次数
-    await manager.consume(key)
-
-    raw = r.json()
-    remaining = await store.client.hget(f"token:{key.client_id}", "remaining")
-    remaining_int: Optional[int] = int(remaining) if remaining is not None else None
-
-    return OCRResponse(baidu_raw=raw, used_key=key.client_id, remaining_estimate=remaining_int)
+    return await forward_ocr(http, data, file_digest)
 
 
 @app.post("/ocr/upload_smart", response_model=OCRResponse)
@@ -846,140 +1285,110 @@ async def ocr_upload_smart(
         verify_parameter: Optional[str] = Form(None),
         probability: Optional[str] = Form(None),
         location: Optional[str] = Form(None),
-        api_key_valid: bool = Depends(verify_api_key)
+        api_key_valid: bool = Depends(verify_api_key),
+        http: httpx.AsyncClient = Depends(get_http_client)
 ):
     # 构建请求数据
-    data = {}
+    data: Dict[str, Any] = {}
+    chosen_key: Optional[str] = None
+    file_digest: Optional[str] = None
 
     # 处理文件上传
     if file is not None:
         # 检查文件类型和大小
-        allowed_types = {
-            'image/jpeg', 'image/jpg', 'image/png', 'image/bmp',
-            'image/gif', 'image/webp', 'application/pdf', 'application/ofd'
-        }
 
-        if file.content_type not in allowed_types:
+        if file.content_type not in SMART_UPLOAD_CONTENT_TYPES:
             raise HTTPException(
                 status_code=400,
-                detail=f"不支持的文件类型: {file.content_type}。支持的类型: {', '.join(allowed_types)}"
+                detail=f"不支持的文件类型: {file.content_type}。支持的类型: {SMART_UPLOAD_CONTENT_TYPES_TEXT}"
             )
 
-        # 检查文件大小 (限制为 4MB，符合百度API要求)
-        max_size = 4 * 1024 * 1024  # 4MB
-        file_content = await file.read()
-
-        if len(file_content) > max_size:
-            raise HTTPException(
-                status_code=400,
-                detail=f"文件大小超过限制。最大允许: {max_size // (1024 * 1024)}MB，当前文件: {len(file_content) // (1024 * 1024)}MB"
-            )
+        # 检查文件大小 (限制为 4MB，符合百度API要求)，边读取边base64编码
+        file_base64, file_digest = await read_form_base64(file, MAX_UPLOAD_SIZE)
 
         # 根据文件类型设置对应参数
-        file_base64 = base64.b64encode(file_content).decode()
-
-        if file.content_type == 'application/pdf':
-            data["pdf_file"] = file_base64
-        elif file.content_type == 'application/ofd':
-            data["ofd_file"] = file_base64
-        else:  # 图片类型
-            data["image"] = file_base64
+        chosen_key = CONTENT_TYPE_FIELDS.get(file.content_type, "image")
+        data[chosen_key] = file_base64
 
-    # 处理表单参数（按优先级）
+    # 处理表单参数（按优先级，上传文件优先）
     # 优先级：image > url > pdf_file > ofd_file
-    if image:
-        data["image"] = image
-    elif url and "image" not in data:
-        data["url"] = url
-    elif pdf_file and "image" not in data and "url" not in data:
-        data["pdf_file"] = pdf_file
-    elif ofd_file and "image" not in data and "url" not in data and "pdf_file" not in data:
-        data["ofd_file"] = ofd_file
+    if chosen_key is None:
+        if image:
+            chosen_key = "image"
+            data["image"] = image
+        elif url:
+            chosen_key = "url"
+            data["url"] = url
+        elif pdf_file:
+            chosen_key = "pdf_file"
+            data["pdf_file"] = pdf_file
+        elif ofd_file:
+            chosen_key = "ofd_file"
+            data["ofd_file"] = ofd_file
 
     # 添加页码参数
-    if pdf_file_num and ("pdf_file" in data):
+    if pdf_file_num and chosen_key == "pdf_file":
         data["pdf_file_num"] = pdf_file_num
-    if ofd_file_num and ("ofd_file" in data):
+    if ofd_file_num and chosen_key == "ofd_file":
         data["ofd_file_num"] = ofd_file_num
 
     # 添加功能参数
-    if verify_parameter in ["true", "false"]:
+    if verify_parameter in BOOL_STRINGS:
         data["verify_parameter"] = verify_parameter
-    if probability in ["true", "false"]:
+    if probability in BOOL_STRINGS:
         data["probability"] = probability
-    if location in ["true", "false"]:
+    if location in BOOL_STRINGS:
         data["location"] = location
 
     # 验证至少有一个主要参数
-    main_params = ["image", "url", "pdf_file", "ofd_file"]
-    if not any(param in data for param in main_params):
+    if chosen_key is None:
         raise HTTPException(
             status_code=400,
             detail="需要提供以下参数之一：文件上传、image、url、pdf_file、ofd_file"
         )
 
-    # 获取 token
-    token, key = await manager.get_token()
-
     # 调用百度 OCR API
-    async with httpx.AsyncClient(timeout=30) as client:
-        url_endpoint = f"{settings.baidu_ocr_url}?access_token={token}"
-        r = await client.post(
-            url_endpoint, data=data, headers={"content-type": "application/x-www-form-urlencoded"}
-        )
-
-    await store.client.incrby("metrics:requests_total", 1)
-
-    if r.status_code != 200:
-        await store.client.incrby("metrics:upstream_errors_total", 1)
-        # 401/400：视为 token 失效，立即将 remaining 置 0 强制下次刷新
-        if r.status_code in (400, 401):
-            await store.client.hset(f"token:{key.client_id}", mapping={"remaining": 0})
-        raise HTTPException(status_code=502, detail=f"上游 OCR 错误: {r.status_code} {r.text}")
-
-    # 正常扣减一次使用次数
-    await manager.consume(key)
-
-    raw = r.json()
-    remaining = await store.client.hget(f"token:{key.client_id}", "remaining")
-    remaining_int: Optional[int] = int(remaining) if remaining is not None else None
-
-    return OCRResponse(baidu_raw=raw, used_key=key.client_id, remaining_estimate=remaining_int)
+    return await forward_ocr(http, data, file_digest)
+
+
+ROOT_INFO = {
+    "name": "百度 AIP 代理服务",
+    "version": "1.3.0",
+    "security": "API密钥校验已启用" if hot_settings.api_key else "无安全校验",
+    "endpoints": [
+        "GET /health",
+        "GET /token/state 🔒",
+        "POST /token/refresh 🔒",
+        "GET /quota/status 🔒",
+        "POST /ocr/url 🔒",
+        "POST /ocr/upload 🔒",
+        "POST /ocr/upload_smart 🔒",
+    ],
+    "description": {
+        "/health": "健康检查（无需API密钥）",
+        "/ocr/url": "票据URL识别 - 支持13种常见票据（增值税发票、火车票、出租车票、飞机行程单等）的分类及结构化识别，支持混贴场景",
+        "/ocr/upload": "直接上传图片或PDF文件进行OCR识别（支持jpg、png、pdf等格式）",
+        "/ocr/upload_smart": "智能OCR接口 - 支持百度API所有参数（image/url/pdf_file/ofd_file + 验真/置信度/坐标等）",
+        "/quota/status": "查看月配额、QPS和Token使用情况"
+    },
+    "auth_info": {
+        "required": bool(hot_settings.api_key),
+        "method": "Header",
+        "headers": ["Authorization: Bearer <API_KEY>", "X-API-Key", "API-Key"],
+        "examples": {
+            "bearer": "curl -H 'Authorization: Bearer 123456' http://localhost:8000/quota/status",
+            "x_api_key": "curl -H 'X-API-Key: 123456' http://localhost:8000/quota/status",
+            "api_key": "curl -H 'API-Key: 123456' http://localhost:8000/quota/status"
+        }
+    }
+}
+# 服务信息只依赖启动时的配置，预先序列化，请求时直接返回
+ROOT_RESPONSE = Response(content=orjson.dumps(ROOT_INFO), media_type="application/json")
 
 
 @app.get("/")
 async def root():
-    return {
-        "name": "百度 AIP 代理服务",
-        "version": "1.3.0",
-        "security": "API密钥校验已启用" if settings.api_key else "无安全校验",
-        "endpoints": [
-            "GET /health",
-            "GET /token/state 🔒",
-            "POST /token/refresh 🔒",
-            "GET /quota/status 🔒",
-            "POST /ocr/url 🔒",
-            "POST /ocr/upload 🔒",
-            "POST /ocr/upload_smart 🔒",
-        ],
-        "description": {
-            "/health": "健康检查（无需API密钥）",
-            "/ocr/url": "票据URL识别 - 支持13种常见票据（增值税发票、火车票、出租车票、飞机行程单等）的分类及结构化识别，支持混贴场景",
-            "/ocr/upload": "直接上传图片或PDF文件进行OCR识别（支持jpg、png、pdf等格式）",
-            "/ocr/upload_smart": "智能OCR接口 - 支持百度API所有参数（image/url/pdf_file/ofd_file + 验真/置信度/坐标等）",
-            "/quota/status": "查看月配额、QPS和Token使用情况"
-        },
-        "auth_info": {
-            "required": bool(settings.api_key),
-            "method": "Header",
-            "headers": ["Authorization: Bearer <API_KEY>", "X-API-Key", "API-Key"],
-            "examples": {
-                "bearer": "curl -H 'Authorization: Bearer 123456' http://localhost:8000/quota/status",
-                "x_api_key": "curl -H 'X-API-Key: 123456' http://localhost:8000/quota/status",
-                "api_key": "curl -H 'API-Key: 123456' http://localhost:8000/quota/status"
-            }
-        }
-    }
+    return ROOT_RESPONSE
 
 
 # ---------------------------